@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+# encoding: UTF-8
+
+"""
+Generate test runners from VAPI files of test libraries with diorite-testgen and run their tests with `./waf check`.
+"""
+
+import os
+import sys
+
+from waflib import Task, Utils, Errors, Logs, Context
+from waflib.TaskGen import feature, before_method, after_method
+
+
+class diorite_testgen(Task.Task):
+	vars  = ['DIORITE_TESTGEN', 'DIORITE_TESTGEN_FLAGS']
+	color = 'BLUE'
+
+	def run(self):
+		cmd = self.env.DIORITE_TESTGEN + self.env.DIORITE_TESTGEN_FLAGS
+		cmd.extend(['-i', self.inputs[0].abspath(), '-o', self.outputs[0].abspath()])
+		return self.exec_command(cmd)
+
+
+class diorite_testlist(Task.Task):
+	"""List test paths of a runner and schedule a diorite_test task for each of them."""
+	color = 'BLUE'
+	always_run = True
+
+	def keyword(self):
+		return 'Listing tests of'
+
+	def run(self):
+		try:
+			output = self.generator.bld.cmd_and_log(
+				[self.inputs[0].abspath(), '-l'], env=test_environment(self), quiet=Context.BOTH)
+		except Errors.WafError as e:
+			Logs.error('Cannot list tests of %s: %s', self.inputs[0].abspath(), e)
+			return 1
+		self.more_tasks = []
+		for path in output.splitlines():
+			if path.startswith('/'):
+				task = self.generator.create_task('diorite_test', self.inputs[0])
+				task.test_path = path
+				task.dep_nodes = self.dep_nodes
+				self.more_tasks.append(task)
+		return 0
+
+
+class diorite_test(Task.Task):
+	"""
+	Run a single test path of a runner.
+
+	The signature consists of the runner binary, shared libraries it links and the test path, so a test which
+	has passed is not run again until one of them changes.
+
+	A failed test doesn't fail its task, so that the other tests run without `-k`. Its signature is not stored
+	to run it again next time and the build fails after the summary of all tests is printed.
+	"""
+	color = 'PINK'
+	failed = False
+
+	def uid(self):
+		try:
+			return self.uid_
+		except AttributeError:
+			self.uid_ = Utils.h_list([self.__class__.__name__, self.inputs[0].abspath(), self.test_path])
+			return self.uid_
+
+	def sig_vars(self):
+		Task.Task.sig_vars(self)
+		self.m.update(self.test_path.encode('utf-8'))
+
+	def keyword(self):
+		return 'Testing'
+
+	def __str__(self):
+		return self.test_path
+
+	def runnable_status(self):
+		status = Task.Task.runnable_status(self)
+		if status == Task.SKIP_ME:
+			test_results(self.generator.bld)['cached'] += 1
+		return status
+
+	def run(self):
+		results = test_results(self.generator.bld)
+		try:
+			self.generator.bld.cmd_and_log(
+				[self.inputs[0].abspath(), '-p', self.test_path], env=test_environment(self), quiet=Context.BOTH,
+				output=Context.BOTH)
+		except Errors.WafError as e:
+			self.failed = True
+			results['failed'].append(self.test_path)
+			Logs.error(
+				'%s failed:\n%s%s', self.test_path, getattr(e, 'stdout', '') or '', getattr(e, 'stderr', '') or '')
+		else:
+			results['passed'] += 1
+		return 0
+
+	def post_run(self):
+		if not self.failed:
+			Task.Task.post_run(self)
+
+
+def test_environment(task):
+	"""Return environment variables to run a test runner with the shared libraries it links from the build."""
+	env = dict(os.environ)
+	dirs = []
+	for node in task.dep_nodes:
+		path = node.parent.abspath()
+		if path not in dirs:
+			dirs.append(path)
+	if env.get('LD_LIBRARY_PATH'):
+		dirs.append(env['LD_LIBRARY_PATH'])
+	env['LD_LIBRARY_PATH'] = os.pathsep.join(dirs)
+	return env
+
+
+def test_results(bld):
+	try:
+		return bld.diorite_test_results
+	except AttributeError:
+		bld.diorite_test_results = results = {'passed': 0, 'cached': 0, 'failed': []}
+		bld.add_post_fun(print_test_results)
+		return results
+
+
+def print_test_results(bld):
+	results = bld.diorite_test_results
+	Logs.pprint(
+		'RED' if results['failed'] else 'GREEN', '%d tests passed, %d cached, %d failed' % (
+			results['passed'], results['cached'], len(results['failed'])))
+	for path in results['failed']:
+		Logs.pprint('RED', '    %s' % path)
+	if results['failed']:
+		bld.fatal('%d tests failed' % len(results['failed']))
+
+
+@before_method('process_source')
+@feature('diorite_testgen')
+def process_testgen(self):
+	"""
+	Generate a test runner from a VAPI file of a library with test cases, build it and, with `./waf check`,
+	run each of its tests as a separate task.
+
+	ctx(features = 'c cprogram diorite_testgen',
+		target = 'run-tests',
+		testgen_source = ctx.path.find_or_declare('tests.vapi'),
+		testgen_flags = '--worker --instrument',
+		use = ['tests'],
+		...
+	)
+	"""
+	vapi = getattr(self, 'testgen_source', None)
+	if not vapi:
+		self.bld.fatal('Missing attribute "testgen_source".')
+	if isinstance(vapi, str):
+		vapi = self.path.find_or_declare(vapi)
+	runner = self.path.find_or_declare(self.target + '.vala')
+	task = self.create_task('diorite_testgen', vapi, runner)
+	task.env.DIORITE_TESTGEN_FLAGS = Utils.to_list(getattr(self, 'testgen_flags', []))
+	# Regenerate the runner when the generator itself changes.
+	script = self.env.DIORITE_TESTGEN[-1]
+	if os.path.isabs(script):
+		node = self.bld.root.find_node(script)
+		if node:
+			task.dep_nodes.append(node)
+	self.source = self.to_nodes(getattr(self, 'source', [])) + [runner]
+
+
+@after_method('apply_link', 'process_use')
+@feature('diorite_testgen')
+def process_testgen_check(self):
+	if self.bld.cmd != 'check' or not getattr(self, 'testgen_check', True):
+		return
+	task = self.create_task('diorite_testlist', self.link_task.outputs[0])
+	task.dep_nodes = list(self.link_task.dep_nodes)
+
+
+def configure(conf):
+	if conf.env.DIORITE_TESTGEN:
+		return
+	# An installed diorite-testgen, otherwise testgen.py next to this tool in the source tree of Diorite.
+	if not conf.find_program(['diorite-testgen4', 'diorite-testgen'], var='DIORITE_TESTGEN', mandatory=False):
+		tool_dir = os.path.dirname(os.path.abspath(__file__))
+		conf.env.DIORITE_TESTGEN = [sys.executable, os.path.join(tool_dir, 'testgen.py')]
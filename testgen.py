@@ -22,18 +22,28 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import time
+
+# CPU time of the interpreter start-up and compilation of this script, which happen before its first line runs.
+STARTUP = time.process_time()
+IMPORT_START = time.perf_counter()
+
+import json
+import os
 import re
 import sys
-from collections import OrderedDict
-
-import pyparsing as pp
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from types import MappingProxyType
 
 
 class Node:
-    pass
+    __slots__ = ()
 
 
 class Namespace(Node):
+    __slots__ = ("name", "members")
+
     def __init__(self, name, members):
         super().__init__()
         self.name = name
@@ -48,6 +58,8 @@ class Namespace(Node):
         return "".join(buf)
 
 class Class(Node):
+    __slots__ = ("name", "access", "members", "parent", "interfaces", "anotations", "abstract", "constructors", "methods")
+
     def __init__(self, name, access, parent=None, abstract=False, interfaces=None, anotations=None, methods=None, constructors=None):
         super().__init__()
         self.name = name
@@ -60,6 +72,12 @@ class Class(Node):
         self.constructors = constructors
         self.methods = methods
 
+    def copy(self):
+        """Return a shallow copy whose name, parent and interfaces can be resolved without changing this class."""
+        return Class(
+            self.name, self.access, self.parent, self.abstract, self.interfaces, self.anotations, self.methods,
+            self.constructors)
+
     def __repr__(self):
         buf = ["<Class %s" % self.name]
         if self.parent:
@@ -81,7 +99,11 @@ class Class(Node):
 
 
 class Method(Node):
-    def __init__(self, name, access, parent=None, rtype=None, params=None, throws=None, override=False, abstract=False, anotations=None, is_async=False):
+    __slots__ = (
+        "name", "access", "parent", "rtype", "params", "throws", "override", "abstract", "anotations", "is_async",
+        "is_static")
+
+    def __init__(self, name, access, parent=None, rtype=None, params=None, throws=None, override=False, abstract=False, anotations=None, is_async=False, is_static=False):
         super().__init__()
         self.name = name
         self.access = access
@@ -93,6 +115,7 @@ class Method(Node):
         self.abstract = abstract
         self.anotations = anotations
         self.is_async = is_async
+        self.is_static = is_static
 
     def __repr__(self):
         buf = ["<Method %s -> %s" % (self.name, self.rtype)]
@@ -100,6 +123,8 @@ class Method(Node):
             buf.append(", %s" % self.access)
         if self.abstract:
             buf.append(", abstract")
+        if self.is_static:
+            buf.append(", static")
         if self.is_async:
             buf.append(", async")
         if self.override:
@@ -115,6 +140,8 @@ class Method(Node):
 
 
 class Constructor(Node):
+    __slots__ = ("name", "access", "parent", "params", "throws", "anotations")
+
     def __init__(self, name, access, parent=None, params=None, throws=None, anotations=None):
         super().__init__()
         self.name = name
@@ -138,6 +165,10 @@ class Constructor(Node):
         return "".join(buf)
 
 
+ClassIndex = namedtuple("ClassIndex", "ancestors interfaces tests benchmarks")
+ClassIndex.__doc__ = "Resolved ancestors, interfaces and effective test and benchmark methods of a class."
+
+
 def tokenMap(func, *args):
     def pa(s,l,t):
         return [func(tokn, *args) for tokn in t]
@@ -186,6 +217,7 @@ def parse_class(toks):
     return Class(
         name=toks.name,
         parent= toks.parent[0],
+        interfaces=list(toks.parent[1:]),
         anotations=toks.anotations,
         access=toks.access,
         abstract=bool(toks.abstract),
@@ -208,6 +240,7 @@ def parse_method(toks):
         override = bool(toks.override),
         abstract = bool(toks.abstract),
         is_async = bool(toks.is_async),
+        is_static = bool(toks.is_static),
         rtype = toks.rtype,
         anotations = toks.anotations,
         throws = list(toks.throws) if toks.throws else [])
@@ -217,42 +250,509 @@ def parse_namespace(toks):
     return Namespace(toks.name, toks.members)
 
 
+# Start-up is CPU time because the wall-clock start of the interpreter is unknown; other entries are wall-clock.
+timings = OrderedDict([("startup (CPU)", STARTUP)])
+
+
+@contextmanager
+def timing(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
 # VAPI Parser Grammar
-ident = pp.Word(pp.alphas + '_', pp.alphanums + '_').setName("ident")
-dot_ident = pp.Combine(ident + pp.ZeroOrMore(pp.Literal(".") + ident))
-integer = pp.Regex(r'[+-]?\d+').setName("integer").setParseAction(tokenMap(int))
-real = pp.Regex(r'[+-]?\d+\.\d*').setName("real").setParseAction(tokenMap(float))
-sci_real = pp.Regex(r'[+-]?\d+([eE][+-]?\d+|\.\d*([eE][+-]?\d+)?)').setName("scireal").setParseAction(tokenMap(float))
-number = (sci_real | real | integer).streamline()
-string = pp.QuotedString("\"", "\\")
-null = pp.Literal("null").setParseAction(lambda toks: None)
-true = pp.Literal("true").setParseAction(lambda toks: True)
-false = pp.Literal("false").setParseAction(lambda toks: False)
-value = string | number | null | true | false
-param = pp.Group(ident + pp.Literal("=").suppress() + value)
-type_name = pp.Combine(dot_ident + pp.Optional(pp.Literal("?")))("type_name")
-params = pp.Group(pp.Optional(param + pp.ZeroOrMore(pp.Literal(',').suppress() + param))).setParseAction(parse_params)("params")
-params_in_parens = pp.Literal('(').suppress() + pp.Optional(params) + pp.Literal(')').suppress()
-anotation = pp.Group(pp.Literal('[').suppress() + ident("name") + pp.Optional(params_in_parens) + pp.Literal(']').suppress()).setParseAction(parse_anotation)
-anotations = pp.ZeroOrMore(anotation).setParseAction(parse_anotations)("anotations")
-access = pp.Optional(pp.Keyword("protected") | pp.Keyword("public") | pp.Keyword("private") | pp.Keyword("internal"))("access")
-abstract = pp.Optional(pp.Keyword("abstract"))("abstract")
-is_async = pp.Optional(pp.Keyword("async"))("is_async")
-override = pp.Optional(pp.Keyword("override"))("override")
-throws = (pp.Optional(pp.Keyword("throws").suppress() + dot_ident + pp.ZeroOrMore(pp.Literal(',').suppress() + dot_ident)))("throws")
-arg = type_name + ident + pp.Optional(pp.Literal("=") + value)
-args = arg + pp.ZeroOrMore(pp.Literal(',') + arg)
-args_in_parens = pp.Group(pp.Literal('(') + pp.Optional(args) + pp.Literal(')'))
-method = (anotations + access + override + is_async + type_name()("rtype") + ident()("name") + args_in_parens + throws + pp.Literal(';').suppress()).setParseAction(parse_method)
-member = pp.Group(access + type_name + ident + pp.Literal(';'));
-constructor = (access + dot_ident()("name") + args_in_parens + throws + pp.Literal(';')).setParseAction(parse_constructor)
-klass_body = pp.ZeroOrMore(constructor | method | member)
-klass = (anotations + access + abstract + pp.Keyword("class") \
- + type_name()("name") + pp.Optional(pp.Literal(":").suppress() + type_name)("parent") \
- + pp.Group(pp.Literal('{').suppress() + klass_body + pp.Literal('}').suppress())("body")).setParseAction(parse_class)
-namespace_elements = klass
-namespace = (pp.Keyword("namespace").suppress() + dot_ident.copy()("name") + pp.Literal('{').suppress() + pp.Group(pp.ZeroOrMore(namespace_elements))("members") + pp.Literal('}').suppress()).setParseAction(parse_namespace)
-toplevel = pp.OneOrMore(namespace | klass).ignore(pp.cppStyleComment)
+toplevel = None
+
+
+def get_grammar():
+    """Return the top-level element of the VAPI grammar, which is built on the first call."""
+    global toplevel
+    if toplevel is None:
+        with timing("import pyparsing"):
+            import pyparsing
+        with timing("grammar"):
+            toplevel = build_grammar(pyparsing)
+    return toplevel
+
+
+def build_grammar(pp):
+    ident = pp.Word(pp.alphas + '_', pp.alphanums + '_').setName("ident")
+    dot_ident = pp.Combine(ident + pp.ZeroOrMore(pp.Literal(".") + ident))
+    integer = pp.Regex(r'[+-]?\d+').setName("integer").setParseAction(tokenMap(int))
+    real = pp.Regex(r'[+-]?\d+\.\d*').setName("real").setParseAction(tokenMap(float))
+    sci_real = pp.Regex(r'[+-]?\d+([eE][+-]?\d+|\.\d*([eE][+-]?\d+)?)').setName("scireal").setParseAction(tokenMap(float))
+    number = (sci_real | real | integer).streamline()
+    string = pp.QuotedString("\"", "\\")
+    null = pp.Literal("null").setParseAction(lambda toks: None)
+    true = pp.Literal("true").setParseAction(lambda toks: True)
+    false = pp.Literal("false").setParseAction(lambda toks: False)
+    value = string | number | null | true | false
+    param = pp.Group(ident + pp.Literal("=").suppress() + value)
+    type_name = pp.Combine(dot_ident + pp.Optional(pp.Literal("?")))("type_name")
+    params = pp.Group(pp.Optional(param + pp.ZeroOrMore(pp.Literal(',').suppress() + param))).setParseAction(parse_params)("params")
+    params_in_parens = pp.Literal('(').suppress() + pp.Optional(params) + pp.Literal(')').suppress()
+    anotation = pp.Group(pp.Literal('[').suppress() + ident("name") + pp.Optional(params_in_parens) + pp.Literal(']').suppress()).setParseAction(parse_anotation)
+    anotations = pp.ZeroOrMore(anotation).setParseAction(parse_anotations)("anotations")
+    access = pp.Optional(pp.Keyword("protected") | pp.Keyword("public") | pp.Keyword("private") | pp.Keyword("internal"))("access")
+    abstract = pp.Optional(pp.Keyword("abstract"))("abstract")
+    is_async = pp.Optional(pp.Keyword("async"))("is_async")
+    is_static = pp.Optional(pp.Keyword("static"))("is_static")
+    override = pp.Optional(pp.Keyword("override"))("override")
+    throws = (pp.Optional(pp.Keyword("throws").suppress() + dot_ident + pp.ZeroOrMore(pp.Literal(',').suppress() + dot_ident)))("throws")
+    arg = type_name + ident + pp.Optional(pp.Literal("=") + value)
+    args = arg + pp.ZeroOrMore(pp.Literal(',') + arg)
+    args_in_parens = pp.Group(pp.Literal('(') + pp.Optional(args) + pp.Literal(')'))
+    method = (anotations + access + is_static + override + is_async + type_name()("rtype") + ident()("name") + args_in_parens + throws + pp.Literal(';').suppress()).setParseAction(parse_method)
+    member = pp.Group(access + type_name + ident + pp.Literal(';'));
+    constructor = (access + dot_ident()("name") + args_in_parens + throws + pp.Literal(';')).setParseAction(parse_constructor)
+    klass_body = pp.ZeroOrMore(constructor | method | member)
+    klass = (anotations + access + abstract + pp.Keyword("class") \
+     + type_name()("name") + pp.Optional(pp.Literal(":").suppress() + type_name + pp.ZeroOrMore(pp.Literal(",").suppress() + type_name))("parent") \
+     + pp.Group(pp.Literal('{').suppress() + klass_body + pp.Literal('}').suppress())("body")).setParseAction(parse_class)
+    namespace_elements = klass
+    namespace = (pp.Keyword("namespace").suppress() + dot_ident.copy()("name") + pp.Literal('{').suppress() + pp.Group(pp.ZeroOrMore(namespace_elements))("members") + pp.Literal('}').suppress()).setParseAction(parse_namespace)
+    toplevel = pp.OneOrMore(namespace | klass).ignore(pp.cppStyleComment)
+    return toplevel
+
+
+# Fast VAPI Parser
+class ParseError(Exception):
+    pass
+
+
+TOKEN_RE = re.compile(r'''
+    (?P<space>\s+|//[^\n]*|/\*(?:[^*]|\*(?!/))*\*/)
+    | (?P<string>"(?:[^"\\]|\\.)*")
+    | (?P<number>[+-]?\d+(?:[eE][+-]?\d+|\.\d*(?:[eE][+-]?\d+)?)?)
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<punct>[{}()\[\];:,=.?])
+    ''', re.DOTALL | re.VERBOSE)
+ACCESS_KEYWORDS = ("protected", "public", "private", "internal")
+SCAN_TOKEN_RE = re.compile(TOKEN_RE.pattern + r'''
+    | (?P<char>'(?:[^'\\\n]|\\.)*')
+    | (?P<other>.)
+    ''', re.DOTALL | re.VERBOSE)
+SCAN_MODIFIERS = ACCESS_KEYWORDS + (
+    "static", "override", "virtual", "abstract", "async", "new", "extern", "inline", "sealed", "owned", "unowned",
+    "weak", "partial")
+
+
+def tokenize(data, token_re=TOKEN_RE):
+    tokens = []
+    pos = 0
+    end = len(data)
+    match = token_re.match
+    while pos < end:
+        m = match(data, pos)
+        if not m:
+            raise ParseError("Unexpected character %r %s" % (data[pos], location(data, pos)))
+        kind = m.lastgroup
+        if kind != "space":
+            tokens.append((kind, m.group(kind), pos, m.end()))
+        pos = m.end()
+    tokens.append((None, None, end, end))
+    return tokens
+
+
+def location(data, pos):
+    line = data.count("\n", 0, pos) + 1
+    col = pos - data.rfind("\n", 0, pos)
+    return "(at char %d), (line:%d, col:%d)" % (pos, line, col)
+
+
+class FastParser:
+    """
+    Hand-written recursive-descent parser for the same VAPI subset as the pyparsing grammar.
+
+    It builds the very same Namespace/Class/Method/Constructor nodes, but it also accepts
+    nested namespaces and classes without a parent class.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.tokens = tokenize(data)
+        self.pos = 0
+
+    def parse(self):
+        result = []
+        while self.peek() is not None:
+            result.append(self.parse_namespace() if self.peek() == "namespace" else self.parse_class())
+        if not result:
+            self.error("namespace or class")
+        return result
+
+    def peek(self, offset=0):
+        return self.tokens[self.pos + offset][1]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token[1]
+
+    def accept(self, value):
+        if self.tokens[self.pos][1] == value:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, value):
+        if self.tokens[self.pos][1] != value:
+            self.error(repr(value))
+        self.pos += 1
+
+    def error(self, expected):
+        _kind, value, start, _end = self.tokens[self.pos]
+        found = "end of text" if value is None else repr(value)
+        raise ParseError("Expected %s, found %s %s" % (expected, found, location(self.data, start)))
+
+    def ident(self):
+        if self.tokens[self.pos][0] != "ident":
+            self.error("ident")
+        return self.next()
+
+    def dot_ident(self):
+        parts = [self.ident()]
+        while self.peek() == "." and self.adjacent() and self.tokens[self.pos + 1][0] == "ident" and self.adjacent(1):
+            self.pos += 1
+            parts.append(self.next())
+        return ".".join(parts)
+
+    def type_name(self):
+        name = self.dot_ident()
+        if self.peek() == "?" and self.adjacent():
+            self.pos += 1
+            name += "?"
+        return name
+
+    def adjacent(self, offset=0):
+        return self.tokens[self.pos + offset - 1][3] == self.tokens[self.pos + offset][2]
+
+    def value(self):
+        kind, value, _start, _end = self.tokens[self.pos]
+        if kind == "string":
+            self.pos += 1
+            return re.sub(r'\\(.)', r'\1', value[1:-1])
+        if kind == "number":
+            self.pos += 1
+            return float(value) if "." in value or "e" in value or "E" in value else int(value)
+        if value in ("null", "true", "false"):
+            self.pos += 1
+            return {"null": None, "true": True, "false": False}[value]
+        self.error("value")
+
+    def access(self):
+        if self.peek() in ACCESS_KEYWORDS:
+            return self.next()
+        return ""
+
+    def anotations(self):
+        anotations = OrderedDict()
+        while self.accept("["):
+            name = self.ident()
+            params = {}
+            if self.accept("("):
+                if self.peek() != ")":
+                    while True:
+                        key = self.ident()
+                        self.expect("=")
+                        params[key] = self.value()
+                        if not self.accept(","):
+                            break
+                self.expect(")")
+            self.expect("]")
+            anotations[name] = params
+        return anotations
+
+    def args(self):
+        self.expect("(")
+        if self.peek() != ")":
+            while True:
+                self.type_name()
+                self.ident()
+                if self.accept("="):
+                    self.value()
+                if not self.accept(","):
+                    break
+        self.expect(")")
+
+    def throws(self):
+        throws = []
+        if self.accept("throws"):
+            throws.append(self.dot_ident())
+            while self.accept(","):
+                throws.append(self.dot_ident())
+        return throws
+
+    def parse_namespace(self):
+        self.expect("namespace")
+        name = self.dot_ident()
+        self.expect("{")
+        members = []
+        while not self.accept("}"):
+            members.append(self.parse_namespace() if self.peek() == "namespace" else self.parse_class())
+        return Namespace(name, members)
+
+    def parse_class(self):
+        anotations = self.anotations()
+        access = self.access()
+        abstract = self.accept("abstract")
+        self.expect("class")
+        name = self.type_name()
+        parent = self.type_name() if self.accept(":") else None
+        interfaces = []
+        while parent and self.accept(","):
+            interfaces.append(self.type_name())
+        self.expect("{")
+        methods = []
+        constructors = []
+        while not self.accept("}"):
+            if self.peek() is None:
+                self.error("'}'")
+            member = self.parse_member()
+            if isinstance(member, Method):
+                methods.append(member)
+            elif isinstance(member, Constructor):
+                constructors.append(member)
+        return Class(
+            name=name, parent=parent, interfaces=interfaces, anotations=anotations, access=access, abstract=abstract,
+            methods=methods, constructors=constructors)
+
+    def parse_member(self):
+        anotations = self.anotations()
+        access = self.access()
+        is_static = self.accept("static")
+        override = self.accept("override")
+        is_async = self.accept("async")
+        start = self.pos
+        type_name = self.type_name()
+        if self.peek() == "(":
+            if anotations or is_static or override or is_async or type_name.endswith("?"):
+                self.pos = start
+                self.error("method")
+            self.args()
+            throws = self.throws()
+            self.expect(";")
+            return Constructor(name=type_name, access=access, anotations="", throws=throws)
+        name = self.ident()
+        if self.peek() == "(":
+            self.args()
+            throws = self.throws()
+            self.expect(";")
+            return Method(
+                name=name, access=access, override=override, abstract=False, is_async=is_async,
+                is_static=is_static, rtype=type_name, anotations=anotations, throws=throws)
+        if anotations or is_static or override or is_async:
+            self.error("'('")
+        self.expect(";")
+        return None
+
+
+class ScanParser(FastParser):
+    """
+    Tolerant parser which skips by brace matching everything that cannot contain tests.
+
+    Only namespaces, class headers and members of candidate classes are parsed. Candidates are public non-abstract
+    classes with the 'Test' suffix and their ancestors defined in the same input, other classes are left without
+    members. Interfaces, structs, enums, delegates, signals, properties, constants and generics are skipped.
+    """
+    def __init__(self, data, candidates_only=True):
+        self.data = data
+        self.tokens = tokenize(data, SCAN_TOKEN_RE)
+        self.pos = 0
+        self.headers = []
+        self.candidates_only = candidates_only
+
+    def parse(self):
+        result = self.parse_members(None)
+        if self.peek() is not None:
+            self.error("end of text")
+        self.parse_candidates()
+        return result
+
+    def parse_members(self, ns):
+        members = []
+        while self.peek() not in (None, "}"):
+            self.skip_anotations()
+            modifiers = self.modifiers()
+            if self.accept("namespace"):
+                name = self.dot_ident()
+                self.expect("{")
+                members.append(Namespace(name, self.parse_members(ns + "." + name if ns else name)))
+                self.expect("}")
+            elif self.peek() == "class":
+                members.append(self.parse_class_header(ns, modifiers))
+            else:
+                self.skip_construct()
+        return members
+
+    def parse_class_header(self, ns, modifiers):
+        self.expect("class")
+        name = self.ident()
+        self.skip_generics()
+        types = []
+        if self.accept(":"):
+            types.append(self.scan_base_type())
+            while self.accept(","):
+                types.append(self.scan_base_type())
+        body = self.pos
+        self.skip_balanced("{", "}")
+        klass = Class(
+            name=name, parent=types[0] if types else None, interfaces=types[1:],
+            anotations=OrderedDict(), access=next((m for m in modifiers if m in ACCESS_KEYWORDS), ""),
+            abstract="abstract" in modifiers, methods=[], constructors=[])
+        self.headers.append((ns, klass, body))
+        return klass
+
+    def parse_candidates(self):
+        classes = OrderedDict()
+        for ns, klass, body in self.headers:
+            classes[ns + "." + klass.name if ns else klass.name] = (ns, klass, body)
+        pending = [
+            name for name, (ns, klass, body) in classes.items()
+            if not self.candidates_only
+            or klass.access == "public" and not klass.abstract and klass.name.endswith("Test")]
+        parsed = set()
+        while pending:
+            name = pending.pop()
+            if name in parsed:
+                continue
+            parsed.add(name)
+            ns, klass, body = classes[name]
+            self.pos = body
+            self.parse_body(klass)
+            if klass.parent:
+                prefix = ns.split(".") if ns else []
+                while True:
+                    parent = ".".join(prefix + [klass.parent])
+                    if parent in classes:
+                        pending.append(parent)
+                        break
+                    if not prefix:
+                        break
+                    prefix.pop()
+
+    def parse_body(self, klass):
+        self.expect("{")
+        while not self.accept("}"):
+            if self.peek() is None:
+                self.error("'}'")
+            member = self.scan_member()
+            if isinstance(member, Method):
+                klass.methods.append(member)
+            elif isinstance(member, Constructor):
+                klass.constructors.append(member)
+
+    def scan_member(self):
+        self.skip_anotations()
+        modifiers = self.modifiers()
+        if self.tokens[self.pos][0] != "ident" or self.peek() in (
+                "class", "interface", "struct", "enum", "errordomain", "delegate", "signal", "const", "construct"):
+            self.skip_construct()
+            return None
+        access = next((m for m in modifiers if m in ACCESS_KEYWORDS), "")
+        type_name = self.scan_type()
+        if self.peek() == "(":
+            self.skip_balanced("(", ")")
+            throws = self.scan_throws()
+            self.skip_construct()
+            return Constructor(name=type_name, access=access, anotations="", throws=throws)
+        if self.tokens[self.pos][0] != "ident":
+            self.skip_construct()
+            return None
+        name = self.ident()
+        self.skip_generics()
+        if self.peek() != "(":
+            self.skip_construct()
+            return None
+        self.skip_balanced("(", ")")
+        throws = self.scan_throws()
+        self.skip_construct()
+        return Method(
+            name=name, access=access, override="override" in modifiers, abstract="abstract" in modifiers,
+            is_async="async" in modifiers, is_static="static" in modifiers, rtype=type_name, anotations=OrderedDict(),
+            throws=throws)
+
+    def scan_type(self):
+        start = self.pos
+        self.dot_ident()
+        self.skip_generics()
+        while True:
+            if self.peek() == "[":
+                self.skip_balanced("[", "]")
+            elif self.peek() in ("?", "*"):
+                self.pos += 1
+            else:
+                break
+        return "".join(token[1] for token in self.tokens[start:self.pos])
+
+    def scan_base_type(self):
+        """Return the name of a parent class or an interface without type arguments, so that it can be resolved."""
+        name = self.dot_ident()
+        self.skip_generics()
+        return name
+
+    def scan_throws(self):
+        throws = []
+        if self.accept("throws"):
+            throws.append(self.scan_type())
+            while self.accept(","):
+                throws.append(self.scan_type())
+        return throws
+
+    def modifiers(self):
+        modifiers = []
+        while self.peek() in SCAN_MODIFIERS:
+            modifiers.append(self.next())
+        return modifiers
+
+    def skip_anotations(self):
+        while self.peek() == "[":
+            self.skip_balanced("[", "]")
+
+    def skip_generics(self):
+        if self.peek() == "<":
+            self.skip_balanced("<", ">")
+
+    def skip_balanced(self, opening, closing):
+        self.expect(opening)
+        depth = 1
+        tokens = self.tokens
+        pos = self.pos
+        while depth:
+            value = tokens[pos][1]
+            if value is None:
+                self.pos = pos
+                self.error(repr(closing))
+            if value == opening:
+                depth += 1
+            elif value == closing:
+                depth -= 1
+            pos += 1
+        self.pos = pos
+
+    def skip_construct(self):
+        """Skip a declaration up to and including ';' or a block in braces."""
+        while True:
+            value = self.peek()
+            if value is None:
+                self.error("';'")
+            if value == ";":
+                self.pos += 1
+                return
+            if value == "{":
+                self.skip_balanced("{", "}")
+                return
+            if value == "}":
+                return
+            self.pos += 1
+
+
+PARSERS = ("pyparsing", "fast", "scan")
+DEFAULT_PARSER = "pyparsing"
+CLASS_FIXTURES = ("set_up_class", "tear_down_class")
+BENCHMARK_PREFIX = "bench_"
 
 
 def info(text):
@@ -260,19 +760,72 @@ def info(text):
 
 
 class TestParser:
-    def __init__(self):
+    def __init__(self, engine="pyparsing"):
+        if engine not in PARSERS:
+            raise ValueError("Unknown parser engine %r." % engine)
+        self.engine = engine
         self.toplevel_ns = Namespace(None, None)
         self.classes = OrderedDict()
         self.namespaces = []
         self.class_names = set()
         self.children = []
+        self._index = None
+
+    def parse_data(self, data, candidates_only=True):
+        """Parse data and return top-level nodes without qualifying class names or resolving parents."""
+        if self.engine == "fast":
+            with timing("parse"):
+                return FastParser(data).parse()
+        if self.engine == "scan":
+            with timing("parse"):
+                return ScanParser(data, candidates_only).parse()
+        grammar = get_grammar()
+        import pyparsing
+        with timing("parse"):
+            try:
+                return grammar.parseString(data, parseAll=True)
+            except pyparsing.ParseException as e:
+                raise ParseError(str(e)) from e
 
-    def parse(self, data):
-        result = toplevel.parseString(data, parseAll=True)
-        self.toplevel_ns = Namespace(None, result)
-        self.ns = None
-        self.walk_namespace(self.toplevel_ns)
-        self.resolve_parents()
+    def parse(self, data, resolve=True, candidates_only=True):
+        result = self.parse_data(data, candidates_only)
+        with timing("resolve"):
+            self.toplevel_ns = Namespace(None, result)
+            self.ns = None
+            self.walk_namespace(self.toplevel_ns)
+            if resolve:
+                self.resolve_parents()
+        return self.toplevel_ns
+
+    def parse_files(self, paths, jobs=None):
+        """
+        Parse files in a pool of processes and merge them into a single class table.
+
+        Parent classes are resolved across all files, so a test class can inherit from a test case defined in
+        another file. The scan engine therefore parses all classes of each file when there are more files, because
+        it cannot tell which of them are ancestors of test classes in other files.
+        """
+        candidates_only = len(paths) == 1
+        with timing("parse"):
+            if len(paths) > 1 and jobs != 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(jobs) as executor:
+                    results = list(executor.map(
+                        parse_file, paths, [self.engine] * len(paths), [candidates_only] * len(paths)))
+            else:
+                results = [parse_file(path, self.engine, candidates_only) for path in paths]
+        with timing("resolve"):
+            members = []
+            for path, (namespaces, classes, children) in zip(paths, results):
+                members.extend(namespaces)
+                for name, klass in classes.items():
+                    if name in self.class_names:
+                        info("The class %s from %s replaces a class of the same name." % (name, path))
+                    self.class_names.add(name)
+                    self.classes[name] = klass
+                self.children.extend(children)
+            self.toplevel_ns = Namespace(None, members)
+            self.resolve_parents()
         return self.toplevel_ns
 
     def walk_namespace(self, ns):
@@ -294,26 +847,95 @@ class TestParser:
         self.ns = self.namespaces.pop()
 
     def resolve_parents(self):
+        resolved = {}
         for ns, child in self.children:
-            ns = ns.split(".") if ns else []
-            while True:
-                name = ".".join(ns + [child.parent])
-                if name in self.class_names:
-                    child.parent = name
-                    break
-                try:
-                    ns.pop()
-                except IndexError:
-                    break
+            child.parent = self.resolve_name(ns, child.parent, resolved)
+            if child.interfaces:
+                child.interfaces = [self.resolve_name(ns, name, resolved) for name in child.interfaces]
+        self.build_index()
+
+    def resolve_name(self, ns, name, resolved):
+        """Resolve a class name relative to a namespace and its parent namespaces, results are memoised."""
+        try:
+            return resolved[ns, name]
+        except KeyError:
+            pass
+        prefix = ns.split(".") if ns else []
+        result = name
+        while True:
+            candidate = ".".join(prefix + [name])
+            if candidate in self.class_names:
+                result = candidate
+                break
+            try:
+                prefix.pop()
+            except IndexError:
+                break
+        resolved[ns, name] = result
+        return result
+
+    def build_index(self):
+        """
+        Build an index of resolved ancestors, interfaces and effective test and benchmark methods of all classes.
+
+        Each class is indexed once on top of the entry of its parent class, so that the cost is linear in the number
+        of classes and methods regardless of the depth of class hierarchies.
+        """
+        index = {}
+        for name in self.classes:
+            chain = []
+            while name in self.classes and name not in index and name not in chain:
+                chain.append(name)
+                name = self.classes[name].parent
+            base = index.get(name)
+            for class_name in reversed(chain):
+                klass = self.classes[class_name]
+                if base is None:
+                    ancestors = (klass.parent,) if klass.parent else ()
+                    interfaces = tests = benchmarks = ()
+                else:
+                    ancestors = (klass.parent,) + base.ancestors
+                    interfaces, tests, benchmarks = base.interfaces, base.tests, base.benchmarks
+                if klass.interfaces:
+                    interfaces = tuple(OrderedDict.fromkeys(tuple(klass.interfaces) + interfaces))
+                base = index[class_name] = ClassIndex(
+                    ancestors, interfaces,
+                    self.override_methods(klass, "test_", tests),
+                    self.override_methods(klass, BENCHMARK_PREFIX, benchmarks))
+        self._index = index
+
+    def override_methods(self, klass, prefix, inherited):
+        own = tuple(method for method in klass.methods if self.ignored_method(method, prefix) is None)
+        if not own:
+            return inherited
+        names = set(method.name for method in own)
+        return own + tuple(method for method in inherited if method.name not in names)
+
+    @property
+    def index(self):
+        """Read-only mapping of class names to ClassIndex entries, built on the first access if needed."""
+        if self._index is None:
+            self.build_index()
+        return MappingProxyType(self._index)
+
+    def ancestors(self, class_name):
+        """Return names of parent classes from the closest one, including an unknown parent class at the end."""
+        entry = self.index.get(class_name)
+        return list(entry.ancestors) if entry else []
 
     def is_subclass(self, subclass, parent):
+        entry = self.index.get(subclass.name)
+        if entry and self.classes.get(subclass.name) is subclass:
+            return parent in entry.ancestors
         while subclass:
             if subclass.parent == parent:
                 return True
             subclass = self.classes.get(subclass.parent)
         return False
 
-    def find_tests(self):
+    def find_tests(self, prefix="test_"):
+        index = self.index
+        reported = set()
         for klass in self.classes.values():
             if not klass.name.endswith("Test"):
                 info("The class %s has been ignored because it lacks the 'Test' suffix." % klass.name)
@@ -324,56 +946,1009 @@ class TestParser:
             elif not self.is_subclass(klass, "Drt.TestCase"):
                 info("The class %s has been ignored because it is not a Drt.TestCase subclass." % klass.name)
             else:
-                methods_found = set()
+                entry = index[klass.name]
+                for name in (klass.name,) + entry.ancestors:
+                    if name in reported or name not in self.classes:
+                        break
+                    reported.add(name)
+                    for method in self.classes[name].methods:
+                        reason = self.ignored_method(method, prefix)
+                        if reason:
+                            info("The method %s has been ignored because %s." % (method.name, reason))
                 base_path = "/" + klass.name.replace(".", "/") + "/"
-                for method in self.find_test_methods(klass, methods_found):
+                for method in entry.tests if prefix == "test_" else entry.benchmarks:
                     path = base_path + method.name
                     yield (path, klass.name, method.name, method.is_async, method.throws)
 
-    def find_test_methods(self, klass, methods_found):
-        for method in klass.methods:
-            name = method.name
-            if name in methods_found:
-                pass
-            elif not name.startswith("test_"):
-                if name not in ("set_up", "tear_down"):
-                    info("The method %s has been ignored because it lacks the 'test_' prefix." % name)
-            elif method.abstract:
-                info("The method %s has been ignored because it is abstract." % name)
-            elif method.access != "public":
-                info("The method %s has been ignored because it is not public." % name)
-            elif method.rtype != "void":
-                info("The method %s has been ignored because it returns a value." % name)
+    def find_benchmarks(self):
+        return self.find_tests(BENCHMARK_PREFIX)
+
+    def ignored_method(self, method, prefix="test_"):
+        """Return why a method is not a test (or benchmark) method, an empty string if it is not worth reporting."""
+        name = method.name
+        if not name.startswith(prefix):
+            if name not in ("set_up", "tear_down") + CLASS_FIXTURES and not name.startswith(("test_", BENCHMARK_PREFIX)):
+                return "it lacks the '%s' prefix" % prefix
+            return ""
+        if method.abstract:
+            return "it is abstract"
+        if method.is_static:
+            return "it is static"
+        if method.access != "public":
+            return "it is not public"
+        if method.rtype != "void":
+            return "it returns a value"
+        return None
+
+    def find_class_fixtures(self, class_name):
+        """
+        Return qualified names of the set_up_class and tear_down_class methods of a test class or None.
+
+        The methods are public static void methods without parameters and may be inherited from a parent class.
+        """
+        fixtures = []
+        for fixture in CLASS_FIXTURES:
+            for name in [class_name] + self.ancestors(class_name):
+                klass = self.classes.get(name)
+                method = next((m for m in klass.methods if m.name == fixture and m.is_static), None) if klass else None
+                if method:
+                    if method.access != "public":
+                        info("The method %s.%s has been ignored because it is not public." % (klass.name, fixture))
+                    elif method.rtype != "void" or method.throws:
+                        info("The method %s.%s has been ignored because it returns a value or throws an error."
+                             % (klass.name, fixture))
+                    else:
+                        fixtures.append("%s.%s" % (klass.name, fixture))
+                        break
             else:
-                methods_found.add(method.name)
-                yield method
-        try:
-            parent = self.classes[klass.parent]
-        except KeyError:
-            pass
+                fixtures.append(None)
+        return tuple(fixtures)
+
+
+def parse_file(path, engine, candidates_only=True):
+    parser = TestParser(engine)
+    with open(path, encoding="utf-8") as f:
+        data = f.read()
+    try:
+        namespace = parser.parse(data, resolve=False, candidates_only=candidates_only)
+    except ParseError as e:
+        raise ParseError("%s: %s" % (path, e)) from None
+    return list(namespace.members), parser.classes, parser.children
+
+
+MODEL_VERSION = 1
+
+
+def dump_model(parser, tests=None):
+    """
+    Return a JSON-serializable description of the resolved model of a parser.
+
+    It contains classes with their resolved parents, ancestors and methods and test paths, tests default to the
+    result of find_tests(). Use load_model() to rebuild the parser without parsing VAPI files again.
+    """
+    classes = []
+    for klass in parser.classes.values():
+        classes.append(OrderedDict([
+            ("name", klass.name),
+            ("access", klass.access),
+            ("abstract", klass.abstract),
+            ("parent", klass.parent),
+            ("interfaces", klass.interfaces),
+            ("ancestors", parser.ancestors(klass.name)),
+            ("methods", [OrderedDict([
+                ("name", m.name), ("access", m.access), ("rtype", m.rtype), ("is_async", m.is_async),
+                ("is_static", m.is_static), ("override", m.override), ("abstract", m.abstract),
+                ("throws", m.throws)]) for m in klass.methods]),
+            ("constructors", [OrderedDict([
+                ("name", c.name), ("access", c.access), ("throws", c.throws)]) for c in klass.constructors]),
+        ]))
+    if tests is None:
+        tests = parser.find_tests()
+    return OrderedDict([
+        ("version", MODEL_VERSION),
+        ("classes", classes),
+        ("tests", [OrderedDict([
+            ("path", path), ("class", klass), ("method", method), ("is_async", is_async), ("throws", throws)])
+            for path, klass, method, is_async, throws in tests]),
+    ])
+
+
+def load_model(model, engine="fast"):
+    """Rebuild a TestParser with resolved classes from a model written by dump_model() without parsing."""
+    if model.get("version") != MODEL_VERSION:
+        raise ParseError("Unsupported model version %r, expected %d." % (model.get("version"), MODEL_VERSION))
+    parser = TestParser(engine)
+    members = []
+    for entry in model["classes"]:
+        klass = Class(
+            entry["name"], entry["access"], entry["parent"], entry["abstract"], entry["interfaces"],
+            methods=[Method(
+                m["name"], m["access"], rtype=m["rtype"], throws=m["throws"], override=m["override"],
+                abstract=m["abstract"], is_async=m["is_async"], is_static=m["is_static"]) for m in entry["methods"]],
+            constructors=[Constructor(c["name"], c["access"], throws=c["throws"]) for c in entry["constructors"]])
+        members.append(klass)
+        parser.classes[klass.name] = klass
+        parser.class_names.add(klass.name)
+    parser.toplevel_ns = Namespace(None, members)
+    parser.build_index()
+    return parser
+
+
+def describe_model(parser):
+    classes = []
+    for klass in parser.classes.values():
+        classes.append((
+            klass.name, klass.parent, klass.interfaces, klass.access, klass.abstract,
+            [(m.name, m.access, m.rtype, m.override, m.is_async, m.throws) for m in klass.methods],
+            [(c.name, c.access, c.throws) for c in klass.constructors]))
+    return classes, list(parser.find_tests())
+
+
+def compare_parsers(data):
+    """
+    Parse data with all parser engines and compare resulting models.
+
+    Returns a list of differences and a mapping of parser engines to their throughput in lines/s.
+    """
+    lines = data.count("\n") + 1
+    models = {}
+    throughput = {}
+    get_grammar()
+    for engine in PARSERS:
+        parser = TestParser(engine)
+        start = time.perf_counter()
+        parser.parse(data)
+        elapsed = time.perf_counter() - start
+        throughput[engine] = lines / elapsed if elapsed > 0 else float("inf")
+        models[engine] = describe_model(parser)
+
+    reference, reference_tests = models[PARSERS[0]]
+    differences = []
+    for engine in PARSERS[1:]:
+        classes, tests = models[engine]
+        expected = reference
+        if engine == "scan":
+            # Members of classes which cannot contain tests are skipped, abstract methods are recognised.
+            names = set(klass[0] for klass in classes if klass[5] or klass[6])
+            expected = [klass for klass in reference if klass[0] in names]
+            classes = [klass for klass in classes if klass[0] in names]
+        for a, b in zip(expected, classes):
+            if a != b:
+                differences.append("%s: %r != %r" % (engine, a, b))
+        if len(expected) != len(classes):
+            differences.append("%s: %d classes != %d classes" % (engine, len(expected), len(classes)))
+        if reference_tests != tests:
+            differences.append("%s: find_tests() output differs" % engine)
+    return differences, throughput
+
+
+def synthetic_vapi(classes, depth=10, methods=5, namespaces=1, async_every=0, throws_every=0):
+    """
+    Return a VAPI with chains of test classes, each class inherits from the previous one in its chain.
+
+    Each class declares its own test methods and overrides one test method of its parent. Classes are spread
+    over namespaces; every async_every-th method is async and every throws_every-th method throws errors
+    (0 means never).
+    """
+    buf = []
+    per_namespace = -(-classes // max(namespaces, 1))
+    for ns in range(namespaces):
+        buf.append("namespace Bench%s {\n" % (ns if namespaces > 1 else ""))
+        for i in range(min(per_namespace, classes - ns * per_namespace)):
+            chain, level = divmod(i, depth)
+            parent = "Drt.TestCase" if level == 0 else "Chain%dLevel%dTest" % (chain, level - 1)
+            buf.append("\tpublic class Chain%dLevel%dTest : %s {\n" % (chain, level, parent))
+            buf.append("\t\tpublic Chain%dLevel%dTest ();\n" % (chain, level))
+            for j in range(methods):
+                buf.append("\t\tpublic %svoid test_level%d_%d ()%s;\n" % (
+                    "async " if async_every and j % async_every == async_every - 1 else "", level, j,
+                    " throws GLib.IOError, GLib.FileError" if throws_every and j % throws_every == 0 else ""))
+            if level:
+                buf.append("\t\tpublic override void test_level%d_0 ()%s;\n" % (
+                    level - 1, " throws GLib.IOError, GLib.FileError" if throws_every else ""))
+            buf.append("\t}\n")
+        buf.append("}\n")
+    return "".join(buf)
+
+
+BENCHMARK_SIZES = (250, 2500, 25000, 100000)
+BENCHMARK_ENGINE = "fast"
+BENCHMARK_PHASES = ("parse", "resolve_parents", "find_tests", "generate_tests")
+
+
+def benchmark_phases(data, engine, memory=False):
+    """
+    Run parsing, resolution, test discovery and generation of data one after another.
+
+    Returns (tests, {phase: seconds}) or, with memory=True, (tests, {phase: peak KiB}) measured with
+    tracemalloc, which slows the phases down, so durations and memory come from separate runs.
+    """
+    if memory:
+        import tracemalloc
+    if engine == "pyparsing":
+        # The grammar is built once per process, it is not a part of parsing.
+        get_grammar()
+    results = {}
+    parser = TestParser(engine)
+    generator = TestGenerator(parser)
+    state = {}
+    steps = (
+        ("parse", lambda: parser.parse(data, resolve=False)),
+        ("resolve_parents", parser.resolve_parents),
+        ("find_tests", lambda: state.update(tests=list(parser.find_tests()))),
+        ("generate_tests", lambda: generator.generate_runner(state["tests"])),
+    )
+    for phase, func in steps:
+        if memory:
+            tracemalloc.start()
+            func()
+            results[phase] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            func()
+            results[phase] = time.perf_counter() - start
+    return len(state["tests"]), results
+
+
+def benchmark_suite(sizes=BENCHMARK_SIZES, engine=BENCHMARK_ENGINE, namespaces=4, methods=10, depth=5, async_every=4,
+                    throws_every=3):
+    """
+    Measure time and peak memory of each phase of test runner generation for synthetic VAPIs.
+
+    A size is the number of declared test methods. Returns a JSON-serializable report.
+    """
+    # The first run of each phase also pays for compiling regular expressions and warming up caches.
+    benchmark_phases(synthetic_vapi(depth, depth, methods, namespaces, async_every, throws_every), engine)
+    results = []
+    for size in sizes:
+        classes = max(1, size // methods)
+        data = synthetic_vapi(classes, depth, methods, namespaces, async_every, throws_every)
+        tests, durations = benchmark_phases(data, engine)
+        tests, memory = benchmark_phases(data, engine, memory=True)
+        results.append(OrderedDict([
+            ("methods", classes * methods),
+            ("classes", classes),
+            ("tests", tests),
+            ("vapi_bytes", len(data.encode("utf-8"))),
+            ("phases", OrderedDict(
+                (phase, {"seconds": round(durations[phase], 6), "peak_kib": round(memory[phase], 1)})
+                for phase in BENCHMARK_PHASES)),
+        ]))
+    return OrderedDict([
+        ("engine", engine),
+        ("python", sys.version.split()[0]),
+        ("namespaces", namespaces),
+        ("methods_per_class", methods),
+        ("depth", depth),
+        ("async_every", async_every),
+        ("throws_every", throws_every),
+        ("results", results),
+    ])
+
+
+def load_durations(path):
+    """
+    Load durations of tests in seconds.
+
+    The file is either a JSON object mapping test paths to durations in seconds or a report written by a test
+    runner generated with instrument=True.
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("%s: Expected a JSON object, got %s." % (path, type(data).__name__))
+    try:
+        if isinstance(data.get("tests"), list):
+            return {record["path"]: record["duration_us"] / 1000000 for record in data["tests"]}
+        return {test: float(duration) for test, duration in data.items()}
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("%s: Invalid durations: %s" % (path, e))
+
+
+def junit_report(report):
+    """Convert a JSON report written by a test runner generated with instrument=True to JUnit XML."""
+    from xml.etree import ElementTree
+    records = report["tests"]
+    suite = ElementTree.Element("testsuite", {
+        "name": "diorite-testgen",
+        "tests": str(len(records)),
+        "failures": str(sum(1 for record in records if record["failed"])),
+        "time": "%.6f" % (sum(record["duration_us"] for record in records) / 1000000)})
+    for record in records:
+        classname, name = record["path"].strip("/").rsplit("/", 1)
+        testcase = ElementTree.SubElement(suite, "testcase", {
+            "classname": classname.replace("/", "."),
+            "name": name,
+            "time": "%.6f" % (record["duration_us"] / 1000000)})
+        if record["failed"]:
+            ElementTree.SubElement(testcase, "failure", {
+                "message": "%d of %d checks failed" % (record["failed"], record["failed"] + record["passed"])})
+    return ElementTree.tostring(suite, encoding="unicode") + "\n"
+
+
+def shard_tests(tests, shards, durations=None):
+    """
+    Split tests into balanced shards.
+
+    Tests of a class are always kept together. Classes are balanced by the sum of their test durations if
+    durations are given (a test without a known duration counts as an average one), otherwise by the number
+    of their tests. The assignment is deterministic and tests keep their original order within a shard.
+    """
+    classes = OrderedDict()
+    for test in tests:
+        classes.setdefault(test[1], []).append(test)
+    if durations:
+        default = sum(durations.values()) / len(durations)
+        weights = {name: sum(durations.get(test[0], default) for test in items) for name, items in classes.items()}
+    else:
+        weights = {name: len(items) for name, items in classes.items()}
+    order = {name: i for i, name in enumerate(classes)}
+    loads = [0.0] * shards
+    assigned = [[] for i in range(shards)]
+    for name in sorted(classes, key=lambda name: (-weights[name], name)):
+        shard = min(range(shards), key=lambda i: (loads[i], i))
+        loads[shard] += weights[name]
+        assigned[shard].append(name)
+    return [[test for name in sorted(names, key=order.get) for test in classes[name]] for names in assigned]
+
+
+def file_digest(path):
+    import hashlib
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+# Relative to the current directory, which is the top of Diorite's source tree when testgen runs from waf.
+DEFAULT_SOURCES = [
+    os.path.join("src", "tests", "*.vala"),
+    os.path.join("src", "glib", "TestCase.vala"),
+]
+SOURCE_RE = re.compile(r'''
+    //[^\n]*|/\*.*?\*/|"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*'
+    | \b(?P<keyword>namespace|class)\s+(?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+    | [{}]
+    ''', re.DOTALL | re.VERBOSE)
+
+
+def find_sources(patterns):
+    """Return Vala source files matching patterns, raise ValueError if a pattern matches no file."""
+    sources = []
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            import glob
+            paths = sorted(glob.glob(pattern))
         else:
-            yield from self.find_test_methods(parent, methods_found)
+            paths = [pattern] if os.path.isfile(pattern) else []
+        if not paths:
+            raise ValueError(
+                "No Vala source files match %r, pass the sources of test classes with --sources." % pattern)
+        sources.extend(paths)
+    return sources
+
+
+def scan_sources(paths):
+    """
+    Return a mapping of fully qualified names of top-level classes to the Vala source files that define them.
+
+    It is only a light-weight scan of namespace and class declarations, not a Vala parser.
+    """
+    classes = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = f.read()
+        depth = 0
+        namespaces = []
+        pending = None
+        for m in SOURCE_RE.finditer(data):
+            keyword = m.group("keyword")
+            if keyword == "namespace":
+                pending = m.group("name")
+            elif keyword == "class":
+                if not namespaces or namespaces[-1][1] == depth:
+                    name = ".".join([ns for ns, _depth in namespaces] + [m.group("name")])
+                    classes[name] = path
+            elif m.group(0) == "{":
+                depth += 1
+                if pending:
+                    namespaces.append((pending, depth))
+                    pending = None
+            elif m.group(0) == "}":
+                if namespaces and namespaces[-1][1] == depth:
+                    namespaces.pop()
+                depth -= 1
+    return classes
+
+
+def dependency_manifest(parser, tests, sources):
+    """Map test paths to their class, its ancestors and the source files they come from."""
+    manifest = OrderedDict()
+    for path, klass, method, is_async, throws in tests:
+        ancestors = parser.ancestors(klass)
+        files = sorted(set(sources[name] for name in [klass] + ancestors if name in sources))
+        manifest[path] = {"class": klass, "ancestors": ancestors, "sources": files}
+    return manifest
+
+
+def git_changed_files(revision):
+    """Return absolute paths of files changed since a git revision, including uncommitted and untracked changes."""
+    import subprocess
+    try:
+        top_dir = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], universal_newlines=True).strip()
+        output = subprocess.check_output(["git", "diff", "--name-only", revision, "--"], universal_newlines=True)
+        output += subprocess.check_output(
+            ["git", "ls-files", "--others", "--exclude-standard"], cwd=top_dir, universal_newlines=True)
+    except subprocess.CalledProcessError as e:
+        raise ValueError(str(e)) from None
+    return [os.path.join(top_dir, line) for line in output.splitlines() if line]
+
+
+def select_affected_tests(tests, manifest, changed_files):
+    """
+    Return tests whose class or ancestors come from the changed files.
+
+    All tests are selected when testgen itself changes. Tests with unknown sources are always selected.
+    """
+    changed = set(os.path.realpath(path) for path in changed_files)
+    if os.path.realpath(__file__) in changed:
+        return list(tests)
+    selected = []
+    for test in tests:
+        files = manifest[test[0]]["sources"]
+        if not files or any(os.path.realpath(path) in changed for path in files):
+            selected.append(test)
+    return selected
+
+
+WORKER_FLAG = "--diorite-testgen-worker"
+WORKER_TEMPLATE = """int %(prefix)sworker(string[] argv)
+{
+\tint protocol_fd = Posix.dup(1);
+\tPosix.dup2(2, 1);
+\tFileStream protocol = FileStream.fdopen(protocol_fd, "w");
+\tstring? path = null;
+\twhile ((path = stdin.read_line()) != null)
+\t{
+\t\tstdout.flush();
+\t\tstderr.flush();
+\t\tPosix.pid_t pid = Posix.fork();
+\t\tif (pid == 0)
+\t\t{
+\t\t\tstring[] args = {argv[0], "-p", path};
+\t\t\tfor (var i = 2; i < argv.length; i++)
+\t\t\t{
+\t\t\t\targs += argv[i];
+\t\t\t}
+\t\t\tEnvironment.unset_variable("%(report_variable)s");
+\t\t\tint code = %(prefix)smain(args);
+\t\t\tstdout.flush();
+\t\t\tprotocol.printf("counts %%d %%d\\n", %(prefix)spassed, %(prefix)sfailed);
+%(report)s\t\t\tprotocol.flush();
+\t\t\tProcess.exit(code);
+\t\t}
+\t\tint result = -1;
+\t\tint status = 0;
+\t\tif (pid > 0 && Posix.waitpid(pid, out status, 0) == pid)
+\t\t{
+\t\t\tresult = Process.if_exited(status) ? Process.exit_status(status) : 128 + (int) Process.term_sig(status);
+\t\t}
+\t\tprotocol.printf("done %%d\\n", result);
+\t\tprotocol.flush();
+\t}
+\treturn 0;
+}
+
+"""
+
+
+WORKER_REPORT_TEMPLATE = """\t\t\tprotocol.printf("report %%s\\n", %(prefix)sreport.str.replace("\\n", " "));
+"""
+REPORT_VARIABLE = "DIORITE_TESTGEN_REPORT"
+REPORT_TEMPLATE = """StringBuilder %(prefix)sreport;
+
+void %(prefix)srecord(string path, int64 set_up, int64 test, int64 tear_down, int passed, int failed, string extra = "")
+{
+\tif (%(prefix)sreport.len > 0)
+\t{
+\t\t%(prefix)sreport.append(",\\n");
+\t}
+\tint64 duration = set_up + test + tear_down;
+\t%(prefix)sreport.append(@"{\\"path\\": \\"$path\\", \\"duration_us\\": $duration, \\"set_up_us\\": $set_up, ");
+\t%(prefix)sreport.append(@"\\"test_us\\": $test, \\"tear_down_us\\": $tear_down, \\"passed\\": $passed, \\"failed\\": $failed$extra}");
+}
+
+void %(prefix)swrite_report()
+{
+\tstring? path = Environment.get_variable("%(report_variable)s");
+\tif (path == null || path == "")
+\t{
+\t\treturn;
+\t}
+\ttry
+\t{
+\t\tFileUtils.set_contents(path, "{\\"tests\\": [\\n" + %(prefix)sreport.str + "\\n]}\\n");
+\t}
+\tcatch (FileError e)
+\t{
+\t\tcritical("Failed to write test report %%s: %%s", path, e.message);
+\t}
+}
+
+"""
+
+
+MEMORY_TEMPLATE = """#if HAVE_MALLINFO2
+[CCode (cheader_filename = "malloc.h", cname = "struct mallinfo2", has_type_id = false, destroy_function = "")]
+struct %(prefix)smallinfo
+{
+\tsize_t hblkhd;
+\tsize_t uordblks;
+}
+
+[CCode (cheader_filename = "malloc.h", cname = "mallinfo2")]
+extern %(prefix)smallinfo %(prefix)sget_mallinfo();
+#else
+/* mallinfo2() requires glibc >= 2.33, counters of mallinfo() wrap around at 2 GiB. */
+[CCode (cheader_filename = "malloc.h", cname = "struct mallinfo", has_type_id = false, destroy_function = "")]
+struct %(prefix)smallinfo
+{
+\tint hblkhd;
+\tint uordblks;
+}
+
+[CCode (cheader_filename = "malloc.h", cname = "mallinfo")]
+extern %(prefix)smallinfo %(prefix)sget_mallinfo();
+#endif
+
+void %(prefix)smemory_sample(out int64 rss, out int64 heap)
+{
+\trss = 0;
+\ttry
+\t{
+\t\tstring statm;
+\t\tFileUtils.get_contents("/proc/self/statm", out statm);
+\t\trss = int64.parse(statm.split(" ")[1]) * Posix.sysconf(Posix._SC_PAGESIZE) / 1024;
+\t}
+\tcatch (FileError e)
+\t{
+\t\t/* RSS is not available outside Linux. */
+\t}
+\tvar info = %(prefix)sget_mallinfo();
+\theap = (int64) info.uordblks + (int64) info.hblkhd;
+}
+
+string %(prefix)smemory_check(Drt.TestCase test, int64 rss, int64 heap, int instances)
+{
+\tif (%(threshold)d > 0 && heap > %(threshold)d * 1024)
+\t{
+\t\ttest.failed++;
+\t\tTest.fail();
+\t\tif (!Test.quiet())
+\t\t{
+\t\t\tstdout.puts(@"\\tHeap grew by $(heap / 1024) KiB, more than %(threshold)d KiB.\\n");
+\t\t}
+\t}
+\treturn @", \\"rss_kib\\": $rss, \\"heap_bytes\\": $heap, \\"instances\\": $instances";
+}
+
+"""
+
+
+CONCURRENT_ASYNC_TEMPLATE = """MainLoop %(prefix)sasync_loop;
+int %(prefix)sasync_next = 0;
+int %(prefix)sasync_running = 0;
+int[] %(prefix)sasync_failed;
+
+void %(prefix)sasync_start(int index)
+{
+\tswitch (index)
+\t{
+%(cases)s\t}
+}
+
+void %(prefix)sasync_schedule()
+{
+\twhile (%(prefix)sasync_running < %(limit)d && %(prefix)sasync_next < %(count)d)
+\t{
+\t\t%(prefix)sasync_running++;
+\t\t%(prefix)sasync_start(%(prefix)sasync_next++);
+\t}
+}
+
+void %(prefix)sasync_done(Drt.TestCase test, int index)
+{
+\t%(prefix)sasync_failed[index] = test.failed;
+\t%(prefix)sasync_running--;
+\t%(prefix)sasync_schedule();
+\tif (%(prefix)sasync_running == 0)
+\t{
+\t\t%(prefix)sasync_loop.quit();
+\t}
+}
+
+/* Runs before Test.run(), outside of any GLib test, and each test reports its own result later. */
+void %(prefix)srun_concurrent_async()
+{
+\t%(prefix)sasync_loop = new MainLoop();
+\t%(prefix)sasync_failed = new int[%(count)d];
+\t%(prefix)sasync_schedule();
+\tif (%(prefix)sasync_running > 0)
+\t{
+\t\t%(prefix)sasync_loop.run();
+\t}
+}
+
+void %(prefix)sasync_report(int index)
+{
+\tif (%(prefix)sasync_failed[index] > 0)
+\t{
+\t\tTest.fail();
+\t\tif (!Test.quiet())
+\t\t{
+\t\t\tstdout.printf("%%d checks failed in the concurrent run ", %(prefix)sasync_failed[index]);
+\t\t}
+\t}
+}
+
+"""
+
+
+DEADLINE_TEMPLATE = """Mutex %(prefix)swatchdog_mutex;
+Cond %(prefix)swatchdog_cond;
+Thread<void*>? %(prefix)swatchdog_thread = null;
+string? %(prefix)swatchdog_path = null;
+int64 %(prefix)swatchdog_start = 0;
+int64 %(prefix)swatchdog_end = 0;
+
+int64 %(prefix)sdeadline_for(string path)
+{
+\tswitch (path)
+\t{
+%(overrides)s\tdefault:
+\t\treturn %(deadline)d;
+\t}
+}
+
+void* %(prefix)swatchdog()
+{
+\t%(prefix)swatchdog_mutex.lock();
+\twhile (true)
+\t{
+\t\tif (%(prefix)swatchdog_path == null)
+\t\t{
+\t\t\t%(prefix)swatchdog_cond.wait(%(prefix)swatchdog_mutex);
+\t\t}
+\t\telse if (!%(prefix)swatchdog_cond.wait_until(%(prefix)swatchdog_mutex, %(prefix)swatchdog_end)
+\t\t\t&& %(prefix)swatchdog_path != null && GLib.get_monotonic_time() >= %(prefix)swatchdog_end)
+\t\t{
+\t\t\t/* The main thread is stuck in a test, so it doesn't touch anything below. */
+\t\t\tstring path = %(prefix)swatchdog_path;
+\t\t\tint64 elapsed = GLib.get_monotonic_time() - %(prefix)swatchdog_start;
+\t\t\tstdout.flush();
+\t\t\tstderr.puts(@"Watchdog: Test $path is stuck for $(elapsed / 1000) ms, past its deadline. Aborting.\\n");
+%(report)s\t\t\tstderr.flush();
+\t\t\tProcess.abort();
+\t\t}
+\t}
+}
+
+int64 %(prefix)sdeadline_begin(string path, int64 deadline, bool is_async)
+{
+\tint64 start = GLib.get_monotonic_time();
+\tif (deadline <= 0)
+\t{
+\t\treturn start;
+\t}
+\tif (%(prefix)swatchdog_thread == null)
+\t{
+\t\t%(prefix)swatchdog_thread = new Thread<void*>("watchdog", %(prefix)swatchdog);
+\t}
+\t%(prefix)swatchdog_mutex.lock();
+\t%(prefix)swatchdog_path = path;
+\t%(prefix)swatchdog_start = start;
+\t/* A hung async test is stopped by its main loop, the watchdog is a last resort for a blocked loop. */
+\t%(prefix)swatchdog_end = start + (is_async ? 2 * deadline : deadline);
+\t%(prefix)swatchdog_cond.signal();
+\t%(prefix)swatchdog_mutex.unlock();
+\treturn start;
+}
+
+uint %(prefix)sdeadline_timeout(int64 deadline, int64 start, owned SourceFunc func)
+{
+\tif (deadline <= 0)
+\t{
+\t\treturn 0;
+\t}
+\tint64 remaining = start + deadline - GLib.get_monotonic_time();
+\treturn Timeout.add((uint) int64.max(0, remaining / 1000), (owned) func);
+}
+
+void %(prefix)sdeadline_cancel(uint source)
+{
+\tif (source != 0)
+\t{
+\t\tSource.remove(source);
+\t}
+}
+
+void %(prefix)sdeadline_hung(Drt.TestCase test, string path, int64 deadline)
+{
+\ttest.failed++;
+\tTest.fail();
+\tstderr.puts(@"Test $path has not finished within its deadline of $(deadline / 1000) ms, its main loop has been stopped.\\n");
+}
+
+string %(prefix)sdeadline_end(string path, int64 deadline, int64 start)
+{
+\t%(prefix)swatchdog_mutex.lock();
+\t%(prefix)swatchdog_path = null;
+\t%(prefix)swatchdog_mutex.unlock();
+\tif (deadline <= 0)
+\t{
+\t\treturn "";
+\t}
+\tint64 elapsed = GLib.get_monotonic_time() - start;
+\tif (elapsed * 100 >= deadline * %(near)d)
+\t{
+\t\tstderr.puts(@"Test $path took $(elapsed / 1000) ms, close to its deadline of $(deadline / 1000) ms.\\n");
+\t}
+\treturn @", \\"deadline_us\\": $deadline";
+}
+
+"""
+DEADLINE_REPORT_TEMPLATE = """\t\t\t%(prefix)srecord(path, 0, elapsed, 0, 0, 1, ", \\"hung\\": true");
+\t\t\t%(prefix)swrite_report();
+"""
+NEAR_DEADLINE = 80
+
+
+CLASS_FIXTURES_TEMPLATE = """int %(prefix)sclass = -1;
+
+void %(prefix)senter_class(int index)
+{
+\tif (%(prefix)sclass == index)
+\t{
+\t\treturn;
+\t}
+\tswitch (%(prefix)sclass)
+\t{
+%(tear_down)s\tdefault:
+\t\tbreak;
+\t}
+\t%(prefix)sclass = index;
+\tswitch (index)
+\t{
+%(set_up)s\tdefault:
+\t\tbreak;
+\t}
+}
+
+"""
+
+
+TABLE_TEMPLATE = """delegate Drt.TestCase %(prefix)sfactory();
+delegate void %(prefix)sbegin(Drt.TestCase test, AsyncReadyCallback callback);
+delegate void %(prefix)sfinish(Drt.TestCase test, AsyncResult? result) throws GLib.Error;
+
+void %(prefix)sadd(string path, owned %(prefix)sfactory factory, int fixture, owned %(prefix)sfinish finish,
+\towned %(prefix)sbegin? begin = null)
+{
+\tGLib.Test.add_data_func_full(path, () =>
+\t{
+\t\t%(prefix)sdispatch(path, factory, fixture, finish, begin);
+\t});
+}
+
+"""
+
+
+CALLGRIND_TEMPLATE = """/* Client requests of valgrind/callgrind.h, the macros without arguments cannot be bound directly. */
+[CCode (cheader_filename = "valgrind/valgrind.h", cname = "VALGRIND_DO_CLIENT_REQUEST_EXPR")]
+extern size_t %(prefix)scallgrind_request(
+\tsize_t default_value, uint request, void* arg1, void* arg2, void* arg3, void* arg4, void* arg5);
+const uint %(prefix)sCALLGRIND_BASE = 0x43540000; /* VG_USERREQ_TOOL_BASE('C', 'T') */
+const uint %(prefix)sCALLGRIND_DUMP_STATS_AT = %(prefix)sCALLGRIND_BASE + 3;
+const uint %(prefix)sCALLGRIND_START_INSTRUMENTATION = %(prefix)sCALLGRIND_BASE + 4;
+const uint %(prefix)sCALLGRIND_STOP_INSTRUMENTATION = %(prefix)sCALLGRIND_BASE + 5;
+
+void %(prefix)scallgrind_start()
+{
+\t%(prefix)scallgrind_request(0, %(prefix)sCALLGRIND_START_INSTRUMENTATION, null, null, null, null, null);
+}
+
+void %(prefix)scallgrind_stop(string path)
+{
+\t%(prefix)scallgrind_request(0, %(prefix)sCALLGRIND_STOP_INSTRUMENTATION, null, null, null, null, null);
+\t%(prefix)scallgrind_request(0, %(prefix)sCALLGRIND_DUMP_STATS_AT, (void*) path, null, null, null, null);
+}
+
+"""
+
+
+BENCHMARK_TEMPLATE = """delegate int64 %(prefix)sbench_func(int64 iterations);
+
+StringBuilder %(prefix)sresults;
+
+bool %(prefix)sselected(string[] argv, string path)
+{
+\tif (argv.length < 2)
+\t{
+\t\treturn true;
+\t}
+\tfor (int i = 1; i < argv.length; i++)
+\t{
+\t\tif (path.has_prefix(argv[i]))
+\t\t{
+\t\t\treturn true;
+\t\t}
+\t}
+\treturn false;
+}
+
+void %(prefix)sbenchmark(string path, %(prefix)sbench_func func)
+{
+\t// Warm up and find the number of iterations which takes at least the sample time.
+\tint64 iterations = 1;
+\tint64 elapsed = func(iterations);
+\twhile (elapsed < %(sample_time)d)
+\t{
+\t\tint64 estimate = elapsed > 0 ? iterations * %(sample_time)d / elapsed + 1 : iterations * 10;
+\t\titerations = int64.min(iterations * 10, int64.max(iterations * 2, estimate));
+\t\telapsed = func(iterations);
+\t}
+\tdouble[] samples = new double[%(samples)d];
+\tfor (int i = 0; i < samples.length; i++)
+\t{
+\t\tdouble sample = (double) func(iterations) / iterations;
+\t\tint j = i;
+\t\tfor (; j > 0 && samples[j - 1] > sample; j--)
+\t\t{
+\t\t\tsamples[j] = samples[j - 1];
+\t\t}
+\t\tsamples[j] = sample;
+\t}
+\tint n = samples.length;
+\tdouble min = samples[0];
+\tdouble median = n %% 2 == 1 ? samples[n / 2] : (samples[n / 2 - 1] + samples[n / 2]) / 2;
+\tdouble p95 = samples[int.max(0, (int) Math.ceil(0.95 * n) - 1)];
+\tvar values = new StringBuilder();
+\tforeach (double sample in samples)
+\t{
+\t\tvalues.append(values.len > 0 ? @", $sample" : sample.to_string());
+\t}
+\tif (%(prefix)sresults.len > 0)
+\t{
+\t\t%(prefix)sresults.append(",\\n");
+\t}
+\t%(prefix)sresults.append(@"{\\"path\\": \\"$path\\", \\"iterations\\": $iterations, \\"min_ns\\": $min, ");
+\t%(prefix)sresults.append(@"\\"median_ns\\": $median, \\"p95_ns\\": $p95, \\"samples_ns\\": [$(values.str)]}");
+\tstderr.printf("%%s: %%.1f ns/op\\n", path, median);
+}
+
+"""
 
 
 class TestGenerator:
-    def __init__(self, parser, prefix="diorite_testgen_"):
+    def __init__(self, parser, prefix="diorite_testgen_", worker=False, instrument=False, concurrent_async=0,
+                 benchmarks=False, samples=10, sample_time=10, callgrind=False, memory=False, memory_threshold=0,
+                 table=False, deadline=0, deadlines=None):
         self.parser = parser
         if prefix and prefix[-1] != "_":
             prefix += "_"
         self.prefix = prefix or ""
+        self.worker = worker
+        self.instrument = instrument or memory
+        self.concurrent_async = concurrent_async
+        self.benchmarks = benchmarks
+        self.samples = samples
+        self.sample_time = sample_time
+        self.callgrind = callgrind
+        self.memory = memory
+        self.memory_threshold = memory_threshold
+        self.table = table
+        self.deadline = deadline
+        self.deadlines = dict(deadlines or {})
 
     def generate_tests(self, data):
-        buf = ['/* Generated by Diorite Testgen */\n/* Included code blocks are in public domain */\n\n']
         self.parser.parse(data)
+        with timing("generate"):
+            return self.generate_runner(self.parser.find_tests())
+
+    def update_runner(self, tests, path, cache_path):
+        """
+        Write a test runner for tests to path unless they are the same as last time.
+
+        The fingerprint of the tests is compared with the one stored in cache_path and the runner is left
+        untouched (same bytes, same mtime) if they match. Returns True if the runner has been regenerated.
+        """
+        with timing("generate"):
+            fingerprint = self.fingerprint(tests)
+            try:
+                with open(cache_path, encoding="utf-8") as f:
+                    cache = json.load(f)
+            except (OSError, ValueError):
+                cache = {}
+            if cache.get("fingerprint") == fingerprint and cache.get("output") == file_digest(path):
+                info("Cache hit: The test runner %s is up to date." % path)
+                return False
+            info("Cache miss: The test runner %s has to be regenerated." % path)
+            result = self.generate_runner(tests)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(result)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": fingerprint, "output": file_digest(path)}, f)
+            return True
+
+    def fingerprint(self, tests):
+        """Return a digest of everything the generated test runner depends on."""
+        import hashlib
+        digest = hashlib.sha256()
+        digest.update(file_digest(__file__).encode("ascii"))
+        options = {name: value for name, value in vars(self).items() if name != "parser"}
+        class_fixtures = list(self.find_class_fixtures(tests).items())
+        digest.update(json.dumps([options, tests, class_fixtures], sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def generate_runner(self, tests):
+        if self.benchmarks:
+            return self.generate_benchmark_runner(tests)
+        buf = ['/* Generated by Diorite Testgen */\n/* Included code blocks are in public domain */\n\n']
+        if self.worker:
+            buf.append('int %spassed = 0;\nint %sfailed = 0;\n\n' % (self.prefix, self.prefix))
+        if self.instrument:
+            buf.append(REPORT_TEMPLATE % {"prefix": self.prefix, "report_variable": REPORT_VARIABLE})
+        if self.callgrind:
+            buf.append(CALLGRIND_TEMPLATE % {"prefix": self.prefix})
+        if self.memory:
+            buf.append(MEMORY_TEMPLATE % {"prefix": self.prefix, "threshold": self.memory_threshold})
+        if self.has_deadlines:
+            buf.append(DEADLINE_TEMPLATE % {
+                "prefix": self.prefix,
+                "deadline": self.deadline * 1000000,
+                "near": NEAR_DEADLINE,
+                "overrides": "".join(
+                    '\tcase "%s":\n\t\treturn %d;\n' % (path, deadline * 1000000)
+                    for path, deadline in sorted(self.deadlines.items())),
+                "report": DEADLINE_REPORT_TEMPLATE % {"prefix": self.prefix} if self.instrument else ""})
+        class_fixtures = self.find_class_fixtures(tests)
+        if class_fixtures:
+            buf.append(CLASS_FIXTURES_TEMPLATE % {
+                "prefix": self.prefix,
+                "tear_down": "".join(
+                    '\tcase %d:\n\t\t%s();\n\t\tbreak;\n' % (i, tear_down)
+                    for i, (set_up, tear_down) in enumerate(class_fixtures.values()) if tear_down),
+                "set_up": "".join(
+                    '\tcase %d:\n\t\t%s();\n\t\tbreak;\n' % (i, set_up)
+                    for i, (set_up, tear_down) in enumerate(class_fixtures.values()) if set_up)})
+        class_index = {name: i for i, name in enumerate(class_fixtures)}
         run_funcs = []
-        for path, klass, method, is_async, throws in self.parser.find_tests():
+        async_funcs = []
+        table_tests = []
+        if self.table:
+            self.append_dispatcher(buf, tests, bool(class_fixtures))
+            table_tests, tests = tests, []
+        for path, klass, method, is_async, throws in tests:
             run_func = self.prefix + "run" + path.replace("/", "_")
             run_funcs.append((path, run_func))
             buf.append('void %s()\n{\n' % run_func)
+            if class_fixtures:
+                buf.append('\t%senter_class(%d);\n' % (self.prefix, class_index.get(klass, -1)))
+            if self.instrument:
+                buf.append('\tint64 start = GLib.get_monotonic_time();\n')
+            self.append_deadline_begin(buf, path, "true" if is_async else "false")
             buf.append('\tvar test = new %s();\n' % klass)
+            self.append_memory_sample(buf, klass)
             buf.append('\ttest.set_up();\n')
+            if self.instrument:
+                buf.append('\tint64 set_up_end = GLib.get_monotonic_time();\n')
             if is_async:
                 buf.append('\tvar loop = new MainLoop();\n')
+                self.append_deadline_timeout(buf)
+                if self.callgrind:
+                    buf.append('\t%scallgrind_start();\n' % self.prefix)
                 buf.append('\ttest.%s.begin((o, res) =>\n' % method)
                 buf.append('\t{\n')
                 if throws:
@@ -382,42 +1957,1357 @@ class TestGenerator:
                         buf.append('\t\tcatch (%s e%d)\n\t\t{\n\t\t\ttest.exception(e%d);\n\t\t}\n' % (error, i, i))
                 else:
                     buf.append('\t\ttest.%s.end(res);\n' % method)
+                if self.callgrind:
+                    buf.append('\t\t%scallgrind_stop("%s");\n' % (self.prefix, path))
                 buf.append('\t\tloop.quit();\n')
                 buf.append('\t});\n')
                 buf.append('\tloop.run();\n')
+                self.append_deadline_check(buf, path)
             else:
+                if self.callgrind:
+                    buf.append('\t%scallgrind_start();\n' % self.prefix)
                 if throws:
                     buf.append('\ttry\n\t{\n\t\ttest.%s();\n\t}\n' % method)
                     for i, error in enumerate(throws):
                         buf.append('\tcatch (%s e%d)\n\t{\n\t\ttest.exception(e%d);\n\t}\n' % (error, i, i))
                 else:
                     buf.append('\ttest.%s();\n' % method)
-            buf.append('\ttest.tear_down();\n\ttest.summary();\n')
+                if self.callgrind:
+                    buf.append('\t%scallgrind_stop("%s");\n' % (self.prefix, path))
+            self.append_finish(buf, path, klass=klass)
             buf.append('}\n\n')
-        buf.append('int main(string[] argv)\n{\n')
+            if is_async and self.concurrent_async and klass not in class_index:
+                async_funcs.append((path, self.append_async_start(buf, path, klass, method, throws, len(async_funcs))))
+        if async_funcs:
+            buf.append(CONCURRENT_ASYNC_TEMPLATE % {
+                "prefix": self.prefix,
+                "limit": self.concurrent_async,
+                "count": len(async_funcs),
+                "cases": "".join(
+                    '\tcase %d:\n\t\t%s();\n\t\tbreak;\n' % (i, func) for i, (path, func) in enumerate(async_funcs))})
+        if self.worker:
+            buf.append(WORKER_TEMPLATE % {
+                "prefix": self.prefix,
+                "report_variable": REPORT_VARIABLE,
+                "report": WORKER_REPORT_TEMPLATE % {"prefix": self.prefix} if self.instrument else ""})
+            buf.append('int main(string[] argv)\n{\n')
+            buf.append('\tif (argv.length > 1 && argv[1] == "%s")\n\t{\n' % WORKER_FLAG)
+            buf.append('\t\treturn %sworker(argv);\n\t}\n' % self.prefix)
+            buf.append('\treturn %smain(argv);\n}\n\n' % self.prefix)
+            buf.append('int %smain(string[] argv)\n{\n' % self.prefix)
+        else:
+            buf.append('int main(string[] argv)\n{\n')
+        if async_funcs:
+            buf.append('\tbool selected = false;\n')
+            buf.append('\tforeach (unowned string arg in argv)\n\t{\n')
+            buf.append('\t\tif (arg == "-p" || arg.has_prefix("-p=") || arg == "-s" || arg.has_prefix("-s=")\n')
+            buf.append('\t\t\t|| arg == "-l")\n\t\t{\n')
+            buf.append('\t\t\tselected = true;\n\t\t}\n\t}\n')
         buf.append('\tGLib.Test.init(ref argv);\n')
         buf.append('\tTest.set_nonfatal_assertions();\n')
+        if self.instrument:
+            buf.append('\t%sreport = new StringBuilder();\n' % self.prefix)
+        for path, klass, method, is_async, throws in table_tests:
+            factory = "%snew_%s" % (self.prefix, klass.replace(".", "_"))
+            if is_async:
+                buf.append('\t%sadd("%s", %s, %d, (t, r) => ((%s) t).%s.end(r), (t, c) => ((%s) t).%s.begin(c));\n' % (
+                    self.prefix, path, factory, class_index.get(klass, -1), klass, method, klass, method))
+            else:
+                buf.append('\t%sadd("%s", %s, %d, (t, r) => ((%s) t).%s());\n' % (
+                    self.prefix, path, factory, class_index.get(klass, -1), klass, method))
+        concurrent = set(path for path, func in async_funcs)
         for path, run_func in run_funcs:
-            buf.append('\tGLib.Test.add_func("%s", %s);\n' % (path, run_func))
-        buf.append('\treturn Test.run();\n}\n')
+            if path not in concurrent:
+                buf.append('\tGLib.Test.add_func("%s", %s);\n' % (path, run_func))
+        if async_funcs:
+            buf.append('\tif (selected)\n\t{\n')
+            for path, run_func in run_funcs:
+                if path in concurrent:
+                    buf.append('\t\tGLib.Test.add_func("%s", %s);\n' % (path, run_func))
+            buf.append('\t}\n\telse\n\t{\n')
+            buf.append('\t\t%srun_concurrent_async();\n' % self.prefix)
+            for i, (path, func) in enumerate(async_funcs):
+                buf.append('\t\tGLib.Test.add_func("%s", () => %sasync_report(%d));\n' % (path, self.prefix, i))
+            buf.append('\t}\n')
+        if self.instrument or class_fixtures:
+            buf.append('\tint result = Test.run();\n')
+            if class_fixtures:
+                buf.append('\t%senter_class(-1);\n' % self.prefix)
+            if self.instrument:
+                buf.append('\t%swrite_report();\n' % self.prefix)
+            buf.append('\treturn result;\n}\n')
+        else:
+            buf.append('\treturn Test.run();\n}\n')
         return "".join(buf)
 
 
+    def generate_benchmark_runner(self, benchmarks):
+        buf = ['/* Generated by Diorite Testgen */\n/* Included code blocks are in public domain */\n\n']
+        buf.append(BENCHMARK_TEMPLATE % {
+            "prefix": self.prefix, "samples": self.samples, "sample_time": self.sample_time * 1000000})
+        class_fixtures = self.find_class_fixtures(benchmarks)
+        if class_fixtures:
+            buf.append(CLASS_FIXTURES_TEMPLATE % {
+                "prefix": self.prefix,
+                "tear_down": "".join(
+                    '\tcase %d:\n\t\t%s();\n\t\tbreak;\n' % (i, tear_down)
+                    for i, (set_up, tear_down) in enumerate(class_fixtures.values()) if tear_down),
+                "set_up": "".join(
+                    '\tcase %d:\n\t\t%s();\n\t\tbreak;\n' % (i, set_up)
+                    for i, (set_up, tear_down) in enumerate(class_fixtures.values()) if set_up)})
+        class_index = {name: i for i, name in enumerate(class_fixtures)}
+        bench_funcs = []
+        for path, klass, method, is_async, throws in benchmarks:
+            if is_async:
+                info("The method %s.%s has been ignored because async benchmarks are not supported." % (klass, method))
+                continue
+            bench_func = self.prefix + "bench" + path.replace("/", "_")
+            bench_funcs.append((path, klass, bench_func))
+            buf.append('int64 %s(int64 iterations)\n{\n' % bench_func)
+            buf.append('\tvar test = new %s();\n' % klass)
+            buf.append('\ttest.set_up();\n')
+            buf.append('\tint64 start = GLib.get_monotonic_time();\n')
+            buf.append('\tfor (int64 i = 0; i < iterations; i++)\n\t{\n')
+            if throws:
+                buf.append('\t\ttry\n\t\t{\n\t\t\ttest.%s();\n\t\t}\n' % method)
+                for i, error in enumerate(throws):
+                    buf.append('\t\tcatch (%s e%d)\n\t\t{\n\t\t\ttest.exception(e%d);\n\t\t}\n' % (error, i, i))
+            else:
+                buf.append('\t\ttest.%s();\n' % method)
+            buf.append('\t}\n')
+            buf.append('\tint64 elapsed = (GLib.get_monotonic_time() - start) * 1000;\n')
+            buf.append('\ttest.tear_down();\n')
+            buf.append('\treturn elapsed;\n}\n\n')
+        buf.append('int main(string[] argv)\n{\n')
+        buf.append('\t%sresults = new StringBuilder();\n' % self.prefix)
+        for path, klass, bench_func in bench_funcs:
+            buf.append('\tif (%sselected(argv, "%s"))\n\t{\n' % (self.prefix, path))
+            if class_fixtures:
+                buf.append('\t\t%senter_class(%d);\n' % (self.prefix, class_index.get(klass, -1)))
+            buf.append('\t\t%sbenchmark("%s", %s);\n\t}\n' % (self.prefix, path, bench_func))
+        if class_fixtures:
+            buf.append('\t%senter_class(-1);\n' % self.prefix)
+        buf.append('\tstdout.printf("{\\"benchmarks\\": [\\n%%s\\n]}\\n", %sresults.str);\n' % self.prefix)
+        buf.append('\treturn 0;\n}\n')
+        return "".join(buf)
+
+    def find_class_fixtures(self, tests):
+        """Return set_up_class and tear_down_class methods of test classes which have at least one of them."""
+        class_fixtures = OrderedDict()
+        for path, klass, method, is_async, throws in tests:
+            if klass not in class_fixtures:
+                class_fixtures[klass] = self.parser.find_class_fixtures(klass)
+        return OrderedDict((klass, fixtures) for klass, fixtures in class_fixtures.items() if any(fixtures))
+
+    def append_async_start(self, buf, path, klass, method, throws, index):
+        """Append a function which starts the index-th async test on the shared main loop and return its name."""
+        start_func = self.prefix + "start" + path.replace("/", "_")
+        buf.append('void %s()\n{\n' % start_func)
+        if self.instrument:
+            buf.append('\tint64 start = GLib.get_monotonic_time();\n')
+        if self.has_deadlines:
+            # Tests run side by side, so there is no watchdog, only the timeout on the shared main loop.
+            buf.append('\tint64 deadline = %sdeadline_for("%s");\n' % (self.prefix, path))
+            buf.append('\tint64 deadline_start = GLib.get_monotonic_time();\n')
+        buf.append('\tvar test = new %s();\n' % klass)
+        self.append_memory_sample(buf, klass)
+        buf.append('\ttest.set_up();\n')
+        if self.instrument:
+            buf.append('\tint64 set_up_end = GLib.get_monotonic_time();\n')
+        if self.has_deadlines:
+            # A hung test is torn down and reported right away, its callback is ignored if it ever comes.
+            buf.append('\tbool hung = false;\n')
+            buf.append(
+                '\tuint deadline_source = %sdeadline_timeout(deadline, deadline_start, () =>\n\t{\n' % self.prefix)
+            buf.append('\t\thung = true;\n')
+            buf.append('\t\t%sdeadline_hung(test, "%s", deadline);\n' % (self.prefix, path))
+            buf.append('\t\tif (!Test.quiet())\n\t\t{\n\t\t\tstdout.puts("%s ");\n\t\t}\n' % path)
+            self.append_finish(buf, path, "\t\t", klass, hung=True)
+            buf.append('\t\t%sasync_done(test, %d);\n' % (self.prefix, index))
+            buf.append('\t\treturn false;\n\t});\n')
+        buf.append('\ttest.%s.begin((o, res) =>\n' % method)
+        buf.append('\t{\n')
+        if self.has_deadlines:
+            buf.append('\t\tif (hung)\n\t\t{\n\t\t\treturn;\n\t\t}\n')
+            buf.append('\t\t%sdeadline_cancel(deadline_source);\n' % self.prefix)
+        if throws:
+            buf.append('\t\ttry\n\t\t{\n\t\t\ttest.%s.end(res);\n\t\t}\n' % method)
+            for i, error in enumerate(throws):
+                buf.append('\t\tcatch (%s e%d)\n\t\t{\n\t\t\ttest.exception(e%d);\n\t\t}\n' % (error, i, i))
+        else:
+            buf.append('\t\ttest.%s.end(res);\n' % method)
+        buf.append('\t\tif (!Test.quiet())\n\t\t{\n\t\t\tstdout.puts("%s ");\n\t\t}\n' % path)
+        self.append_finish(buf, path, "\t\t", klass)
+        buf.append('\t\t%sasync_done(test, %d);\n' % (self.prefix, index))
+        buf.append('\t});\n')
+        buf.append('}\n\n')
+        return start_func
+
+    def append_dispatcher(self, buf, tests, class_fixtures):
+        """
+        Append the generic part of a table-driven runner.
+
+        Instead of a run function per test, there is a factory per test class and a single dispatcher which
+        takes care of fixtures, async methods and errors. Tests are then registered with one line each.
+        """
+        buf.append(TABLE_TEMPLATE % {"prefix": self.prefix})
+        for klass in OrderedDict((klass, True) for path, klass, method, is_async, throws in tests):
+            buf.append('Drt.TestCase %snew_%s()\n{\n\treturn new %s();\n}\n\n' % (
+                self.prefix, klass.replace(".", "_"), klass))
+        buf.append('void %sdispatch(string path, %sfactory factory, int fixture, %sfinish finish, %sbegin? begin)\n{\n'
+                   % (self.prefix, self.prefix, self.prefix, self.prefix))
+        if class_fixtures:
+            buf.append('\t%senter_class(fixture);\n' % self.prefix)
+        if self.instrument:
+            buf.append('\tint64 start = GLib.get_monotonic_time();\n')
+        self.append_deadline_begin(buf, None, "begin != null")
+        buf.append('\tvar test = factory();\n')
+        self.append_memory_sample(buf, None)
+        buf.append('\ttest.set_up();\n')
+        if self.instrument:
+            buf.append('\tint64 set_up_end = GLib.get_monotonic_time();\n')
+        if self.callgrind:
+            buf.append('\t%scallgrind_start();\n' % self.prefix)
+        buf.append('\tif (begin == null)\n\t{\n')
+        buf.append('\t\ttry\n\t\t{\n\t\t\tfinish(test, null);\n\t\t}\n')
+        buf.append('\t\tcatch (GLib.Error e)\n\t\t{\n\t\t\ttest.exception(e);\n\t\t}\n')
+        buf.append('\t}\n\telse\n\t{\n')
+        buf.append('\t\tvar loop = new MainLoop();\n')
+        self.append_deadline_timeout(buf, "\t\t")
+        buf.append('\t\tbegin(test, (o, res) =>\n\t\t{\n')
+        buf.append('\t\t\ttry\n\t\t\t{\n\t\t\t\tfinish(test, res);\n\t\t\t}\n')
+        buf.append('\t\t\tcatch (GLib.Error e)\n\t\t\t{\n\t\t\t\ttest.exception(e);\n\t\t\t}\n')
+        buf.append('\t\t\tloop.quit();\n\t\t});\n')
+        buf.append('\t\tloop.run();\n')
+        self.append_deadline_check(buf, None, "\t\t")
+        buf.append('\t}\n')
+        if self.callgrind:
+            buf.append('\t%scallgrind_stop(path);\n' % self.prefix)
+        self.append_finish(buf, None)
+        buf.append('}\n\n')
+
+    @property
+    def has_deadlines(self):
+        return bool(self.deadline or self.deadlines)
+
+    def append_deadline_begin(self, buf, path, is_async, indent="\t"):
+        """Append the start of a deadline of a test and arming of the watchdog, is_async is a Vala expression."""
+        if self.has_deadlines:
+            path = '"%s"' % path if path is not None else "path"
+            buf.append('%sint64 deadline = %sdeadline_for(%s);\n' % (indent, self.prefix, path))
+            buf.append('%sint64 deadline_start = %sdeadline_begin(%s, deadline, %s);\n' % (
+                indent, self.prefix, path, is_async))
+
+    def append_deadline_timeout(self, buf, indent="\t"):
+        """Append a timeout which stops the main loop `loop` of a hung async test."""
+        if self.has_deadlines:
+            buf.append('%sbool hung = false;\n' % indent)
+            buf.append('%suint deadline_source = %sdeadline_timeout(deadline, deadline_start, () =>\n%s{\n' % (
+                indent, self.prefix, indent))
+            buf.append('%s\thung = true;\n%s\tloop.quit();\n%s\treturn false;\n%s});\n' % (
+                indent, indent, indent, indent))
+
+    def append_deadline_check(self, buf, path, indent="\t"):
+        if self.has_deadlines:
+            path = '"%s"' % path if path is not None else "path"
+            buf.append('%sif (hung)\n%s{\n%s\t%sdeadline_hung(test, %s, deadline);\n%s}\n' % (
+                indent, indent, indent, self.prefix, path, indent))
+            buf.append('%selse\n%s{\n%s\t%sdeadline_cancel(deadline_source);\n%s}\n' % (
+                indent, indent, indent, self.prefix, indent))
+
+    def append_memory_sample(self, buf, klass, indent="\t"):
+        if self.memory:
+            buf.append('%sint64 rss_before, heap_before;\n' % indent)
+            buf.append('%s%smemory_sample(out rss_before, out heap_before);\n' % (indent, self.prefix))
+            buf.append('%sint instances_before = %s.get_instance_count();\n' % (
+                indent, "typeof(%s)" % klass if klass else "test.get_type()"))
+
+    def append_finish(self, buf, path, indent="\t", klass=None, hung=False):
+        """
+        Append tear down and reporting of a test, path is None if it is held by a variable `path`.
+
+        A hung test is marked in the report of an instrumented runner.
+        """
+        path = '"%s"' % path if path is not None else "path"
+        instances = "typeof(%s)" % klass if klass else "test.get_type()"
+        if self.instrument:
+            lines = [
+                'int64 test_end = GLib.get_monotonic_time();',
+                'test.tear_down();',
+                'int64 tear_down_end = GLib.get_monotonic_time();',
+            ]
+            extra = []
+            if self.has_deadlines:
+                lines.append('string deadline_report = %sdeadline_end(%s, deadline, deadline_start);' % (
+                    self.prefix, path))
+                extra.append("deadline_report")
+            if self.memory:
+                lines.extend([
+                    'int64 rss_after, heap_after;',
+                    '%smemory_sample(out rss_after, out heap_after);' % self.prefix,
+                    'string memory = %smemory_check(test, rss_after - rss_before, heap_after - heap_before, '
+                    '%s.get_instance_count() - instances_before);' % (self.prefix, instances),
+                ])
+                extra.append("memory")
+            if hung:
+                extra.append('", \\"hung\\": true"')
+            lines.extend([
+                'test.summary();',
+                '%srecord(%s, set_up_end - start, test_end - set_up_end, tear_down_end - test_end, '
+                'test.passed, test.failed%s);' % (self.prefix, path, ", " + " + ".join(extra) if extra else ""),
+            ])
+        else:
+            lines = ['test.tear_down();', 'test.summary();']
+            if self.has_deadlines:
+                lines.insert(1, '%sdeadline_end(%s, deadline, deadline_start);' % (self.prefix, path))
+        if self.worker:
+            lines.extend(['%spassed += test.passed;' % self.prefix, '%sfailed += test.failed;' % self.prefix])
+        buf.extend(indent + line + '\n' for line in lines)
+
+
+CHUNK_RE = re.compile(r"""
+    "(?:[^"\\]|\\.)*" | '(?:[^'\\\n]|\\.)*' | //[^\n]* | /\*.*?\*/
+    | \bnamespace\s+(?P<namespace>[A-Za-z_]\w*(?:\s*\.\s*[A-Za-z_]\w*)*)\s*(?P<open>\{)?
+    | (?P<punct>[{};])
+    """, re.DOTALL | re.VERBOSE)
+SPACE_RE = re.compile(r"(?:\s+|//[^\n]*|/\*.*?\*/)*", re.DOTALL)
+
+
+def split_chunks(data):
+    """
+    Split VAPI data into declarations at namespace level.
+
+    Returns a list of (namespace, text) pairs, the namespace is a dotted name or None at the top level. Only braces,
+    semicolons and namespaces are looked for, strings and comments are skipped, declarations are parsed later.
+    """
+    chunks = []
+    namespaces = []
+    depth = 0
+    start = 0
+    for m in CHUNK_RE.finditer(data):
+        name, punct = m.group("namespace", "punct")
+        if name is not None:
+            if m.group("open") is None:
+                raise ParseError("Expected '{' after namespace %s" % location(data, m.start()))
+            if depth:
+                depth += 1
+            else:
+                # Annotations of the namespace are skipped.
+                namespaces.append("".join(name.split()))
+                start = m.end()
+        elif punct == "{":
+            depth += 1
+        elif punct == "}" and depth:
+            depth -= 1
+            if not depth:
+                chunks.append((".".join(namespaces) or None, data[SPACE_RE.match(data, start).end():m.end()]))
+                start = m.end()
+        elif punct == "}":
+            if not namespaces:
+                raise ParseError("Unexpected '}' %s" % location(data, m.start()))
+            check_unterminated(data, start, m.start())
+            namespaces.pop()
+            start = m.end()
+        elif punct == ";" and not depth:
+            chunks.append((".".join(namespaces) or None, data[SPACE_RE.match(data, start).end():m.end()]))
+            start = m.end()
+    if depth or namespaces:
+        raise ParseError("Unexpected end of text %s" % location(data, len(data)))
+    check_unterminated(data, start, len(data))
+    return chunks
+
+
+def check_unterminated(data, start, end):
+    if SPACE_RE.match(data, start, end).end() < end:
+        raise ParseError("Expected ';' or '}' %s" % location(data, end))
+
+
+def copy_nodes(nodes):
+    """Copy nodes of a cached declaration, which are modified when a model is resolved, but share their members."""
+    copies = []
+    for node in nodes:
+        if isinstance(node, Class):
+            node = node.copy()
+        elif isinstance(node, Namespace):
+            node = Namespace(node.name, copy_nodes(node.members))
+        copies.append(node)
+    return copies
+
+
+class ChunkCache:
+    """
+    Keep parsed declarations of VAPI files in memory and re-parse only declarations whose text changed.
+    """
+    def __init__(self, engine="pyparsing"):
+        self.engine = engine
+        self.chunks = {}
+
+    def parse(self, paths):
+        """Return a TestParser with a model of the files built from cached and freshly parsed declarations."""
+        parser = TestParser(self.engine)
+        chunks = {}
+        members = []
+        parsed = 0
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                data = f.read()
+            try:
+                for key in split_chunks(data):
+                    if key in chunks:
+                        nodes = chunks[key]
+                    elif key in self.chunks:
+                        nodes = self.chunks[key]
+                    else:
+                        nodes = self.parse_chunk(parser, *key)
+                        parsed += 1
+                    chunks[key] = nodes
+                    if key[0]:
+                        members.append(Namespace(key[0], copy_nodes(nodes)))
+                    else:
+                        members.extend(copy_nodes(nodes))
+            except ParseError as e:
+                raise ParseError("%s: %s" % (path, e)) from None
+        self.chunks = chunks
+        with timing("resolve"):
+            parser.toplevel_ns = Namespace(None, members)
+            parser.ns = None
+            parser.walk_namespace(parser.toplevel_ns)
+            parser.resolve_parents()
+        info("Parsed %d of %d declarations." % (parsed, len(chunks)))
+        return parser
+
+    def parse_chunk(self, parser, ns, text):
+        if ns:
+            text = "namespace %s {\n%s\n}\n" % (ns, text)
+        # Ancestors of test classes are likely to be in other declarations.
+        result = list(parser.parse_data(text, candidates_only=False))
+        # Cached nodes are never resolved, models get copies of them.
+        return tuple(result[0].members) if ns else tuple(result)
+
+
+class FileWatcher:
+    """
+    Wait for changes of files with inotify, or by polling their modification times where it is not available.
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+
+    def __init__(self, paths, poll_interval=0.5):
+        self.paths = set(os.path.abspath(path) for path in paths)
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.dirs = {}
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            for directory in set(os.path.dirname(path) for path in self.paths):
+                wd = libc.inotify_add_watch(fd, os.fsencode(directory), mask)
+                if wd < 0:
+                    os.close(fd)
+                    raise OSError(ctypes.get_errno(), "inotify_add_watch failed for %s" % directory)
+                self.dirs[wd] = directory
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            info("Falling back to polling: %s" % e)
+            self.mtimes = self.stat()
+
+    def stat(self):
+        mtimes = {}
+        for path in self.paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def wait(self):
+        """Block until some of the files change and return their paths."""
+        if self.fd is None:
+            while True:
+                time.sleep(self.poll_interval)
+                mtimes = self.stat()
+                changed = set(path for path in self.paths if mtimes[path] != self.mtimes[path])
+                self.mtimes = mtimes
+                if changed:
+                    return changed
+        import select
+        import struct
+        changed = set()
+        timeout = None
+        # Editors and build tools often write files in several steps, collect events for a short while.
+        while select.select([self.fd], [], [], timeout)[0]:
+            data = os.read(self.fd, 65536)
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, size = struct.unpack_from("iIII", data, offset)
+                name = data[offset + 16:offset + 16 + size].rstrip(b"\0")
+                offset += 16 + size
+                path = os.path.join(self.dirs.get(wd, ""), os.fsdecode(name))
+                if path in self.paths:
+                    changed.add(path)
+            if changed:
+                timeout = 0.02
+        return changed
+
+
+class Daemon:
+    """
+    Serve test runner generation from warm ChunkCaches for a file watcher and clients on a Unix socket.
+    """
+    def __init__(self, engine="pyparsing", options=None):
+        import threading
+        self.engine = engine
+        self.options = options or {}
+        self.caches = {}
+        self.lock = threading.Lock()
+
+    def generate(self, inputs, output, options=None, engine=None, cache_path=None, use_cache=True):
+        """
+        Regenerate a test runner if needed and return a response for clients.
+
+        The engine defaults to the one of the daemon and cache_path to OUTPUT.cache, the runner is always written
+        if use_cache is False.
+        """
+        start = time.perf_counter()
+        options = dict(self.options, **(options or {}))
+        engine = engine or self.engine
+        with self.lock:
+            try:
+                cache = self.caches.setdefault((engine, tuple(inputs)), ChunkCache(engine))
+                parser = cache.parse(inputs)
+                generator = TestGenerator(parser, **options)
+                tests = list(parser.find_benchmarks() if generator.benchmarks else parser.find_tests())
+                if use_cache:
+                    written = generator.update_runner(tests, output, cache_path or output + ".cache")
+                else:
+                    with open(output, "w", encoding="utf-8") as f:
+                        f.write(generator.generate_runner(tests))
+                    written = True
+            except (OSError, ValueError, TypeError, ParseError) as e:
+                sys.stderr.write("Error: %s\n" % e)
+                return {"status": 1, "error": str(e)}
+        elapsed = (time.perf_counter() - start) * 1000
+        info("Generated %s with %d tests in %.1f ms." % (output, len(tests), elapsed))
+        return {"status": 0, "tests": len(tests), "written": written, "elapsed_ms": elapsed}
+
+    def watch(self, inputs, output):
+        watcher = FileWatcher(inputs)
+        self.generate(inputs, output)
+        while True:
+            watcher.wait()
+            self.generate(inputs, output)
+
+    def serve(self, socket_path):
+        """
+        Accept JSON requests on a Unix socket.
+
+        A request is {"inputs": [...], "output": "...", "options": {...}, "engine": "...", "cache": "...",
+        "use_cache": true}, only inputs and output are required.
+        """
+        import socket
+        import threading
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(8)
+        thread = threading.Thread(target=self.accept, args=(server,), daemon=True)
+        thread.start()
+        return server
+
+    def accept(self, server):
+        import threading
+        while True:
+            try:
+                connection, _address = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def handle(self, connection):
+        with connection, connection.makefile("rw", encoding="utf-8") as stream:
+            for line in stream:
+                try:
+                    request = json.loads(line)
+                    response = self.generate(
+                        request["inputs"], request["output"], request.get("options"), request.get("engine"),
+                        request.get("cache"), request.get("use_cache", True))
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"status": 1, "error": "Invalid request: %s" % e}
+                stream.write(json.dumps(response) + "\n")
+                stream.flush()
+
+
+def request_daemon(socket_path, inputs, output, options, engine=None, cache_path=None, use_cache=True):
+    """Ask a daemon to generate a test runner, return its response or None if no daemon is listening."""
+    import socket
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return None
+    request = {
+        "inputs": [os.path.abspath(path) for path in inputs], "output": os.path.abspath(output), "options": options,
+        "engine": engine, "cache": os.path.abspath(cache_path) if cache_path else None, "use_cache": use_cache}
+    with client, client.makefile("rw", encoding="utf-8") as stream:
+        stream.write(json.dumps(request) + "\n")
+        stream.flush()
+        line = stream.readline()
+    return json.loads(line) if line else None
+
+
+def list_runner_tests(runner, args=None):
+    import subprocess
+    output = subprocess.check_output([runner, "-l"] + (args or []), universal_newlines=True)
+    return [line.strip() for line in output.splitlines() if line.startswith("/")]
+
+
+class TestScheduler:
+    """
+    Run tests of a test runner generated with worker=True in a pool of persistent worker processes.
+
+    Each worker forks a child process for every test path it receives, so tests are isolated from each other
+    without paying for exec and GLib initialization every time.
+    """
+    def __init__(self, runner, jobs=None, args=None):
+        self.runner = os.path.abspath(runner)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.args = args or []
+        self.records = {}
+
+    def list_tests(self):
+        return list_runner_tests(self.runner, self.args)
+
+    def run(self, paths, durations=None):
+        """
+        Run tests, the longest ones first if durations are known.
+
+        Returns a mapping of test paths to a tuple of an exit status and the numbers of passed and failed checks
+        (None if the test crashed before it could report them).
+        """
+        if durations:
+            default = sum(durations.values()) / len(durations)
+            paths = sorted(paths, key=lambda path: -durations.get(path, default))
+        import threading
+        from queue import Queue
+        queue = Queue()
+        for path in paths:
+            queue.put(path)
+        results = {}
+        workers = [threading.Thread(target=self.serve, args=(queue, results)) for i in range(self.jobs)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return OrderedDict((path, results[path]) for path in paths)
+
+    def serve(self, queue, results):
+        import subprocess
+        from queue import Empty
+        process = None
+        try:
+            while True:
+                try:
+                    path = queue.get_nowait()
+                except Empty:
+                    break
+                if process is None:
+                    process = subprocess.Popen(
+                        [self.runner, WORKER_FLAG] + self.args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                        universal_newlines=True, bufsize=1)
+                process.stdin.write(path + "\n")
+                process.stdin.flush()
+                status, passed, failed = None, None, None
+                for line in process.stdout:
+                    kind, *values = line.split()
+                    if kind == "counts":
+                        passed, failed = int(values[0]), int(values[1])
+                    elif kind == "report":
+                        self.records[path] = json.loads("[%s]" % line.split(None, 1)[1]) if values else []
+                    elif kind == "done":
+                        status = int(values[0])
+                        break
+                if status is None:
+                    info("The worker process died while running %s." % path)
+                    process.wait()
+                    process = None
+                    status = -1
+                results[path] = (status, passed, failed)
+        finally:
+            if process is not None:
+                process.stdin.close()
+                process.wait()
+
+
+    def report(self, paths):
+        """Return a report of tests run by a runner generated with instrument=True in the order of paths."""
+        return {"tests": [record for path in paths for record in self.records.get(path, [])]}
+
+
+def report_results(results):
+    """Print results of TestScheduler.run() and return an exit status like GLib.Test.run() does."""
+    exit_status = 0
+    for path, (status, passed, failed) in results.items():
+        ok = status == 0 and not failed
+        if not ok:
+            exit_status = 1
+        if passed is None:
+            counts = "crashed"
+        else:
+            counts = "%d passed, %d failed" % (passed, failed)
+        sys.stdout.write("[%s] %s: %s, exit status %d\n" % ("PASS" if ok else "FAIL", path, counts, status))
+    sys.stdout.write("%d tests, %d failed\n" % (
+        len(results), sum(1 for status, passed, failed in results.values() if status != 0 or failed)))
+    return exit_status
+
+
+def near_deadlines(report, near=NEAR_DEADLINE):
+    """Return (path, duration_us, deadline_us) of tests in a report which took at least near % of their deadline."""
+    return [
+        (record["path"], record["duration_us"], record["deadline_us"]) for record in report.get("tests", [])
+        if record.get("deadline_us") and record["duration_us"] * 100 >= record["deadline_us"] * near]
+
+
+DEFAULT_SUPPRESSIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "diorite.supp")
+LEAK_KINDS = OrderedDict((
+    ("Leak_DefinitelyLost", "definitely_lost"),
+    ("Leak_IndirectlyLost", "indirectly_lost"),
+    ("Leak_PossiblyLost", "possibly_lost"),
+    ("Leak_StillReachable", "still_reachable"),
+))
+
+
+class Memcheck:
+    """
+    Run each test of a test runner under valgrind's memcheck in a pool of parallel valgrind processes.
+    """
+    def __init__(self, runner, jobs=None, suppressions=None, args=None, valgrind="valgrind"):
+        self.runner = os.path.abspath(runner)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.suppressions = suppressions or []
+        self.args = args or []
+        self.valgrind = valgrind
+
+    def run(self, paths):
+        """Return a mapping of test paths to their memcheck reports in the order of paths."""
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        with tempfile.TemporaryDirectory(prefix="diorite-memcheck-") as tmp_dir:
+            with ThreadPoolExecutor(self.jobs) as executor:
+                reports = executor.map(
+                    self.check, paths, [os.path.join(tmp_dir, "%d.xml" % i) for i in range(len(paths))])
+                return OrderedDict(zip(paths, reports))
+
+    def check(self, path, xml_file):
+        import subprocess
+        cmd = [
+            self.valgrind, "--tool=memcheck", "--leak-check=full", "--child-silent-after-fork=yes",
+            "--xml=yes", "--xml-file=" + xml_file]
+        cmd.extend("--suppressions=" + suppressions for suppressions in self.suppressions)
+        cmd.extend([self.runner, "-p", path])
+        cmd.extend(self.args)
+        env = dict(os.environ, G_SLICE="always-malloc", G_DEBUG="gc-friendly")
+        status = subprocess.call(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            report = parse_memcheck_xml(xml_file)
+        except (OSError, ValueError) as e:
+            info("Failed to parse memcheck output of %s: %s" % (path, e))
+            report = parse_memcheck_xml(None)
+            report["errors"] += 1
+        report["exit_status"] = status
+        return report
+
+
+def parse_memcheck_xml(path):
+    """
+    Parse an XML file written by valgrind's memcheck.
+
+    Returns the number of errors other than leaks, the numbers of errors of each kind and leaked bytes by
+    leak kind (definitely_lost, indirectly_lost, possibly_lost and still_reachable).
+    """
+    report = OrderedDict((("errors", 0), ("kinds", OrderedDict())))
+    for name in LEAK_KINDS.values():
+        report[name] = 0
+    if path is None:
+        return report
+    from xml.etree import ElementTree
+    try:
+        root = ElementTree.parse(path).getroot()
+    except ElementTree.ParseError as e:
+        raise ValueError(str(e)) from e
+    for error in root.iter("error"):
+        kind = error.findtext("kind", "Unknown")
+        report["kinds"][kind] = report["kinds"].get(kind, 0) + 1
+        if kind in LEAK_KINDS:
+            report[LEAK_KINDS[kind]] += int(error.findtext("xwhat/leakedbytes", "0"))
+        else:
+            report["errors"] += 1
+    return report
+
+
+class Callgrind:
+    """
+    Profile the test method of each test of a test runner generated with --callgrind in parallel valgrind processes.
+    """
+    def __init__(self, runner, jobs=None, args=None, valgrind="valgrind"):
+        self.runner = os.path.abspath(runner)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.args = args or []
+        self.valgrind = valgrind
+
+    def run(self, paths, output_dir):
+        """Write a callgrind profile of each test to the output directory and return their summaries."""
+        from concurrent.futures import ThreadPoolExecutor
+        os.makedirs(output_dir, exist_ok=True)
+        with ThreadPoolExecutor(self.jobs) as executor:
+            reports = executor.map(self.profile, paths, [output_dir] * len(paths))
+            return OrderedDict(zip(paths, reports))
+
+    def profile(self, path, output_dir):
+        import glob
+        import subprocess
+        profile = os.path.join(output_dir, "callgrind.out." + path.strip("/").replace("/", "."))
+        out_file = profile + ".tmp"
+        cmd = [
+            self.valgrind, "--tool=callgrind", "--instr-atstart=no", "--callgrind-out-file=" + out_file,
+            self.runner, "-p", path]
+        cmd.extend(self.args)
+        status = subprocess.call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # The dump requested by the test runner goes to OUT_FILE.1, the final dump at exit to OUT_FILE.
+        dumps = glob.glob(glob.escape(out_file) + ".*")
+        if os.path.isfile(out_file + ".1"):
+            os.replace(out_file + ".1", profile)
+            instructions = parse_callgrind_summary(profile)
+        else:
+            info("Callgrind has not written a profile of %s." % path)
+            profile = instructions = None
+        for dump in dumps + [out_file]:
+            if os.path.exists(dump):
+                os.remove(dump)
+        return OrderedDict((("profile", profile), ("instructions", instructions), ("exit_status", status)))
+
+
+def parse_callgrind_summary(path):
+    """Return the total number of instructions from the summary of a callgrind profile."""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith(("summary:", "totals:")):
+                return int(line.split()[1])
+    return None
+
+
+def report_callgrind(reports):
+    """Print instruction counts of profiled tests and return a non-zero exit status if any of them failed."""
+    exit_status = 0
+    for path, report in reports.items():
+        ok = report["exit_status"] == 0 and report["instructions"] is not None
+        if not ok:
+            exit_status = 1
+        sys.stdout.write("[%s] %s: %s instructions, exit status %d\n" % (
+            "PASS" if ok else "FAIL", path, report["instructions"], report["exit_status"]))
+    return exit_status
+
+
+def report_memcheck(reports):
+    """Print memcheck reports and return a non-zero exit status if there are errors or definite leaks."""
+    exit_status = 0
+    for path, report in reports.items():
+        ok = report["exit_status"] == 0 and not report["errors"] and not report["definitely_lost"]
+        if not ok:
+            exit_status = 1
+        sys.stdout.write("[%s] %s: %d errors, %d bytes definitely lost, %d bytes indirectly lost, "
+                         "%d bytes possibly lost, exit status %d\n" % (
+                             "PASS" if ok else "FAIL", path, report["errors"], report["definitely_lost"],
+                             report["indirectly_lost"], report["possibly_lost"], report["exit_status"]))
+    sys.stdout.write("%d tests, %d bytes definitely lost in total\n" % (
+        len(reports), sum(report["definitely_lost"] for report in reports.values())))
+    return exit_status
+
+
+def mann_whitney(old, new):
+    """
+    Return the U statistic of new samples and the one-sided p-value of the Mann-Whitney U test that they are
+    greater than old ones (normal approximation with tie and continuity correction).
+    """
+    import math
+    n1, n2 = len(old), len(new)
+    values = sorted([(value, 0) for value in old] + [(value, 1) for value in new])
+    rank_sum = 0.0
+    ties = 0.0
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        rank = (i + j) / 2 + 1
+        rank_sum += rank * sum(1 for k in range(i, j + 1) if values[k][1])
+        count = j - i + 1
+        ties += count ** 3 - count
+        i = j + 1
+    n = n1 + n2
+    u = rank_sum - n2 * (n2 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare_benchmarks(old, new, threshold=5.0, alpha=0.05):
+    """
+    Compare two benchmark reports and return (path, old median, new median, change in percent, p-value, status).
+
+    A benchmark is SLOWER or FASTER only if the change of median exceeds the threshold in percent and the
+    Mann-Whitney U test of samples is significant at the alpha level.
+    """
+    old = {item["path"]: item for item in old["benchmarks"]}
+    results = []
+    for item in new["benchmarks"]:
+        path = item["path"]
+        if path not in old:
+            results.append((path, None, item["median_ns"], None, None, "NEW"))
+            continue
+        old_median, new_median = old[path]["median_ns"], item["median_ns"]
+        change = (new_median - old_median) / old_median * 100 if old_median else 0.0
+        if change > 0:
+            _u, p = mann_whitney(old[path]["samples_ns"], item["samples_ns"])
+        else:
+            _u, p = mann_whitney(item["samples_ns"], old[path]["samples_ns"])
+        if abs(change) <= threshold or p >= alpha:
+            status = "SAME"
+        else:
+            status = "SLOWER" if change > 0 else "FASTER"
+        results.append((path, old_median, new_median, change, p, status))
+    return results
+
+
+def report_benchmarks(results):
+    """Print a comparison of benchmarks and return a non-zero exit status if any of them is slower."""
+    exit_status = 0
+    for path, old_median, new_median, change, p, status in results:
+        if status == "SLOWER":
+            exit_status = 1
+        if old_median is None:
+            sys.stdout.write("[%s] %s: %.1f ns/op\n" % (status, path, new_median))
+        else:
+            sys.stdout.write("[%s] %s: %.1f -> %.1f ns/op (%+.1f %%, p = %.3f)\n" % (
+                status, path, old_median, new_median, change, p))
+    return exit_status
+
+
+def add_generator_arguments(parser):
+    """Add command line arguments to parse VAPI files and generate test runners."""
+    parser.add_argument(
+        "-i", "--input", action="append", default=[],
+        help="source files to extract test cases from, can be repeated or be a glob pattern")
+    parser.add_argument("-o", "--output", help="where to write generated test runner")
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="number of processes to parse inputs or to run tests (default: number of CPUs)")
+    parser.add_argument(
+        "--parser", choices=PARSERS,
+        help="parser engine to use (default: %s); 'scan' skips everything but namespaces, class headers and members "
+        "of classes which may contain tests, so it also accepts full library VAPIs" % DEFAULT_PARSER)
+    parser.add_argument(
+        "--worker", action="store_true",
+        help="generate a test runner with a worker mode for the --run scheduler")
+    parser.add_argument(
+        "--instrument", action="store_true",
+        help="generate a test runner that measures tests and writes a JSON report to $%s" % REPORT_VARIABLE)
+    parser.add_argument(
+        "--memory", action="store_true",
+        help="generate an instrumented test runner that also reports growth of RSS, malloc heap and live instances "
+        "of the test class (with GOBJECT_DEBUG=instance-count) by each test; pass -D HAVE_MALLINFO2 to valac to "
+        "use mallinfo2() of glibc >= 2.33 instead of mallinfo()")
+    parser.add_argument(
+        "--memory-threshold", type=int, default=0, metavar="KIB",
+        help="fail tests of a --memory runner which grow malloc heap by more than KIB kibibytes")
+    parser.add_argument(
+        "--concurrent-async", type=int, default=0, metavar="N",
+        help="generate a test runner that runs up to N async tests concurrently on a shared main loop unless "
+        "tests are selected with -p or skipped with -s; the tests must not depend on each other or on captured "
+        "log messages, each of them reports the result of the concurrent run as its own GLib test")
+    parser.add_argument(
+        "--table", action="store_true",
+        help="generate a compact table-driven test runner: a single dispatcher and one line per test instead of "
+        "a function per test, which makes the runner much faster to compile")
+    parser.add_argument(
+        "--deadline", type=float, default=0, metavar="SECONDS",
+        help="generate a test runner which stops async tests running longer than SECONDS and aborts with a report "
+        "when a test is stuck, tests close to their deadline are reported too")
+    parser.add_argument(
+        "--deadlines", metavar="FILE",
+        help="JSON object mapping test paths to their deadlines in seconds, overriding --deadline, 0 means none")
+    parser.add_argument(
+        "--benchmarks", action="store_true",
+        help="generate a benchmark runner for public void bench_* methods instead of a test runner")
+    parser.add_argument(
+        "--samples", type=int, default=10, help="number of samples of each benchmark (default: 10)")
+    parser.add_argument(
+        "--sample-time", type=int, default=10, metavar="MS",
+        help="minimal duration of a benchmark sample in milliseconds (default: 10)")
+    parser.add_argument(
+        "--callgrind", action="store_true",
+        help="generate a test runner that collects callgrind data only while a test method runs")
+
+
+def expand_inputs(patterns):
+    """Return paths of input files, glob patterns are expanded and must match at least one file."""
+    inputs = []
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            import glob
+            paths = sorted(glob.glob(pattern))
+            if not paths:
+                raise ValueError("No input files match the pattern %r." % pattern)
+            inputs.extend(paths)
+        else:
+            inputs.append(pattern)
+    return inputs
+
+
+def generator_options(args):
+    """Return keyword arguments of TestGenerator for command line arguments added by add_generator_arguments()."""
+    if args.table and args.concurrent_async:
+        raise ValueError("--table cannot be combined with --concurrent-async.")
+    options = dict(
+        worker=args.worker, instrument=args.instrument, concurrent_async=args.concurrent_async,
+        benchmarks=args.benchmarks, samples=args.samples, sample_time=args.sample_time, callgrind=args.callgrind,
+        memory=args.memory, memory_threshold=args.memory_threshold, table=args.table, deadline=args.deadline)
+    if args.deadlines:
+        try:
+            with open(args.deadlines, encoding="utf-8") as f:
+                options["deadlines"] = {path: float(deadline) for path, deadline in json.load(f).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            raise ValueError("Cannot load deadlines from %s: %s" % (args.deadlines, e)) from None
+    return options
+
+
+timings["import"] = time.perf_counter() - IMPORT_START
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--input", type=argparse.FileType('r'), help="source files to extract test cases from")
-    parser.add_argument("-o", "--output", type=argparse.FileType('w'), help="where to write generated test runner")
+    add_generator_arguments(parser)
+    parser.add_argument(
+        "--cache", help="where to store the fingerprint of generated tests (default: OUTPUT.cache)")
+    parser.add_argument(
+        "--no-cache", action="store_false", dest="use_cache", help="always regenerate the test runner")
+    parser.add_argument("--shards", type=int, help="split tests into this number of independent test runners")
+    parser.add_argument("--shard-dir", help="where to write sharded test runners shard-1.vala ... shard-N.vala")
+    parser.add_argument(
+        "--durations", help="JSON file mapping test paths to durations in seconds to balance shards and order tests")
+    parser.add_argument(
+        "--dump-model", metavar="FILE",
+        help="write the resolved model (classes, parents, methods and test paths) as JSON to FILE ('-' for "
+        "stdout), a test runner is generated only with -o or --shards then")
+    parser.add_argument(
+        "--model", metavar="FILE",
+        help="load a model written by --dump-model instead of parsing VAPI files")
+    parser.add_argument(
+        "--compare-parsers", action="store_true",
+        help="parse input with all parser engines, compare results and report throughput")
+    parser.add_argument(
+        "--benchmark-suite", metavar="OUTPUT",
+        help="measure time and peak memory of parse, resolve_parents, find_tests and generate_tests for synthetic "
+        "VAPIs of growing size and write a JSON report to OUTPUT ('-' for stdout); the %r parser engine is "
+        "used unless --parser is given" % BENCHMARK_ENGINE)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=list(BENCHMARK_SIZES), metavar="METHODS",
+        help="numbers of test methods of synthetic VAPIs for --benchmark-suite (default: %s)" % " ".join(
+            str(size) for size in BENCHMARK_SIZES))
+    parser.add_argument(
+        "--corpus", type=int, nargs=5, default=[4, 10, 5, 4, 3],
+        metavar=("NAMESPACES", "METHODS", "DEPTH", "ASYNC", "THROWS"),
+        help="shape of synthetic VAPIs for --benchmark-suite: number of namespaces, methods per class, depth of "
+        "inheritance and every how many methods one is async and one throws errors (default: 4 10 5 4 3)")
+    parser.add_argument(
+        "--compare-benchmarks", nargs=2, metavar=("OLD", "NEW"),
+        help="compare two JSON reports of a benchmark runner and fail on significant regressions")
+    parser.add_argument(
+        "--threshold", type=float, default=5.0, metavar="PERCENT",
+        help="minimal change of median for --compare-benchmarks to be reported (default: 5)")
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="keep parsed inputs in memory and regenerate OUTPUT whenever inputs change, re-parsing only "
+        "changed declarations")
+    parser.add_argument(
+        "--listen", metavar="SOCKET", help="serve requests of --connect clients on a Unix socket")
+    parser.add_argument(
+        "--connect", metavar="SOCKET",
+        help="ask a daemon started with --listen to generate OUTPUT from INPUT with the parser engine of the daemon "
+        "unless --parser is given; it is generated locally if there is no daemon or with --model, --dump-model, "
+        "--shards, --manifest, --since, --changed-files or --compare-parsers")
+    parser.add_argument(
+        "--run", metavar="RUNNER",
+        help="run tests of a test runner generated with --worker in a pool of -j worker processes")
+    parser.add_argument(
+        "--memcheck", metavar="RUNNER",
+        help="run each test of a test runner under valgrind's memcheck in -j parallel processes and write "
+        "a JSON report to OUTPUT; test paths are taken from INPUT if given, otherwise from RUNNER -l")
+    parser.add_argument(
+        "--suppressions", action="append",
+        help="valgrind suppression file for --memcheck, can be repeated (default: src/diorite.supp)")
+    parser.add_argument(
+        "--profile", metavar="RUNNER",
+        help="profile tests of a test runner generated with --callgrind under valgrind's callgrind in -j "
+        "parallel processes and write one profile per test and callgrind.json to the OUTPUT directory "
+        "(default: callgrind); test paths are taken from INPUT if given, otherwise from RUNNER -l")
+    parser.add_argument(
+        "--select", action="append", metavar="PREFIX", help="profile only tests with this path prefix, can be repeated")
+    parser.add_argument(
+        "--report", help="where to write a JSON report of tests run with --run (requires --instrument)")
+    parser.add_argument(
+        "--junit", metavar="REPORT", help="convert a JSON report to JUnit XML and write it to OUTPUT or stdout")
+    parser.add_argument(
+        "--sources", action="append",
+        help="Vala source files of test classes and their parents, can be repeated or be a glob pattern "
+        "(default: src/tests/*.vala and src/glib/TestCase.vala in the current directory)")
+    parser.add_argument(
+        "--manifest", help="where to write a JSON manifest mapping test paths to classes, parents and sources")
+    parser.add_argument(
+        "--since", metavar="REVISION",
+        help="generate a test runner only with tests affected by changes since a git revision")
+    parser.add_argument(
+        "--changed-files", nargs="+", metavar="FILE",
+        help="generate a test runner only with tests affected by changes of these files")
+    parser.add_argument("runner_args", nargs="*", help="extra arguments for the test runner with --run")
+    parser.add_argument(
+        "--timings", action="store_true",
+        help="print how long interpreter start-up (CPU time), import, grammar construction, parse, resolve and "
+        "generate took (wall-clock)")
     args = parser.parse_args()
+    if args.shards is not None and (args.shards < 1 or not args.shard_dir):
+        parser.error("--shards requires a positive number and --shard-dir.")
+
+    if args.run:
+        import subprocess
+        try:
+            scheduler = TestScheduler(args.run, args.jobs, args.runner_args)
+            durations = load_durations(args.durations) if args.durations else None
+            results = scheduler.run(scheduler.list_tests(), durations)
+            report = scheduler.report(results)
+            if args.report:
+                with open(args.report, "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=1)
+            exit_status = report_results(results)
+            for path, duration, deadline in near_deadlines(report):
+                sys.stdout.write("[SLOW] %s: %.1f ms of its %.1f ms deadline\n" % (path, duration / 1000, deadline / 1000))
+            sys.exit(exit_status)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(1)
+
+    if args.compare_benchmarks:
+        try:
+            reports = []
+            for path in args.compare_benchmarks:
+                with open(path, encoding="utf-8") as f:
+                    reports.append(json.load(f))
+            sys.exit(report_benchmarks(compare_benchmarks(reports[0], reports[1], args.threshold)))
+        except (OSError, ValueError, KeyError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(1)
 
-    input = args.input or sys.stdin
-    output = args.output or sys.stdout
-    generator = TestGenerator(TestParser())
-    data = input.read()
+    if args.junit:
+        try:
+            with open(args.junit, encoding="utf-8") as f:
+                result = junit_report(json.load(f))
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    f.write(result)
+            else:
+                sys.stdout.write(result)
+        except (OSError, ValueError, KeyError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(1)
+        sys.exit(0)
+
+    try:
+        inputs = expand_inputs(args.input)
+    except ValueError as e:
+        parser.error(str(e))
     try:
-        result = generator.generate_tests(data)
-        output.write(result)
+        options = generator_options(args)
+    except ValueError as e:
+        sys.stderr.write("Error: %s\n" % e)
+        sys.exit(1)
+    if args.connect and inputs and args.output:
+        # A daemon only generates a single test runner from VAPI files.
+        local_flags = [flag for flag, value in (
+            ("--model", args.model), ("--dump-model", args.dump_model), ("--shards", args.shards),
+            ("--manifest", args.manifest), ("--since", args.since), ("--changed-files", args.changed_files),
+            ("--compare-parsers", args.compare_parsers)) if value]
+        if local_flags:
+            info("A daemon does not support %s, the test runner is generated locally." % ", ".join(local_flags))
+        else:
+            try:
+                response = request_daemon(
+                    args.connect, inputs, args.output, options, args.parser, args.cache, args.use_cache)
+            except (OSError, ValueError) as e:
+                sys.stderr.write("Error: %s\n" % e)
+                sys.exit(1)
+            if response is not None:
+                if response["status"]:
+                    sys.stderr.write("Error: %s\n" % response.get("error"))
+                sys.exit(response["status"])
+            info("No daemon listens on %s, the test runner is generated locally." % args.connect)
+
+    if args.watch or args.listen:
+        if args.watch and not (inputs and args.output):
+            parser.error("--watch requires --input and --output.")
+        try:
+            daemon = Daemon(args.parser or DEFAULT_PARSER, options)
+            if args.listen:
+                daemon.serve(args.listen)
+            if args.watch:
+                daemon.watch(inputs, args.output)
+            else:
+                import threading
+                threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        except (OSError, ValueError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(1)
+        finally:
+            if args.listen and os.path.exists(args.listen):
+                os.remove(args.listen)
         sys.exit(0)
-    except pp.ParseException as e:
-        sys.stderr.write("Parse Error: %s\n" % e)
+
+    test_parser = TestParser(args.parser or DEFAULT_PARSER)
+    if args.memcheck:
+        import subprocess
+        try:
+            if inputs:
+                test_parser.parse_files(inputs, args.jobs)
+                paths = [test[0] for test in test_parser.find_tests()]
+            else:
+                paths = list_runner_tests(args.memcheck, args.runner_args)
+            suppressions = args.suppressions
+            if suppressions is None:
+                suppressions = [DEFAULT_SUPPRESSIONS] if os.path.isfile(DEFAULT_SUPPRESSIONS) else []
+            reports = Memcheck(args.memcheck, args.jobs, suppressions, args.runner_args).run(paths)
+            if args.output:
+                with open(args.output, "w", encoding="utf-8") as f:
+                    json.dump(reports, f, indent=1)
+            sys.exit(report_memcheck(reports))
+        except (OSError, ParseError, subprocess.CalledProcessError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(1)
+
+    if args.profile:
+        import subprocess
+        try:
+            if inputs:
+                test_parser.parse_files(inputs, args.jobs)
+                paths = [test[0] for test in test_parser.find_tests()]
+            else:
+                paths = list_runner_tests(args.profile, args.runner_args)
+            if args.select:
+                paths = [path for path in paths if path.startswith(tuple(args.select))]
+            output_dir = args.output or "callgrind"
+            reports = Callgrind(args.profile, args.jobs, args.runner_args).run(paths, output_dir)
+            with open(os.path.join(output_dir, "callgrind.json"), "w", encoding="utf-8") as f:
+                json.dump(reports, f, indent=1)
+            sys.exit(report_callgrind(reports))
+        except (OSError, ParseError, subprocess.CalledProcessError) as e:
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(1)
+
+    if args.benchmark_suite:
+        report = benchmark_suite(args.sizes, args.parser or BENCHMARK_ENGINE, *args.corpus)
+        for result in report["results"]:
+            info("%d methods, %d tests: %s" % (result["methods"], result["tests"], ", ".join(
+                "%s %.1f ms / %.0f KiB" % (phase, values["seconds"] * 1000, values["peak_kib"])
+                for phase, values in result["phases"].items())))
+        if args.benchmark_suite == "-":
+            json.dump(report, sys.stdout, indent=1)
+            sys.stdout.write("\n")
+        else:
+            with open(args.benchmark_suite, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+        sys.exit(0)
+
+    try:
+        if args.compare_parsers:
+            failed = False
+            for path in inputs or [None]:
+                if path:
+                    with open(path, encoding="utf-8") as f:
+                        data = f.read()
+                else:
+                    data = sys.stdin.read()
+                differences, throughput = compare_parsers(data)
+                for engine, lines_per_second in throughput.items():
+                    sys.stderr.write("%s: %.0f lines/s\n" % (engine, lines_per_second))
+                for difference in differences:
+                    sys.stderr.write("Difference: %s\n" % difference)
+                failed = failed or bool(differences)
+            sys.exit(1 if failed else 0)
+        if args.model:
+            with open(args.model, encoding="utf-8") as f:
+                test_parser = load_model(json.load(f), args.parser or DEFAULT_PARSER)
+        elif inputs:
+            test_parser.parse_files(inputs, args.jobs)
+        else:
+            test_parser.parse(sys.stdin.read())
+        generator = TestGenerator(test_parser, **options)
+        with timing("generate"):
+            tests = list(test_parser.find_benchmarks() if args.benchmarks else test_parser.find_tests())
+        if args.dump_model:
+            model = dump_model(test_parser, tests)
+            if args.dump_model == "-":
+                json.dump(model, sys.stdout, indent=1)
+                sys.stdout.write("\n")
+            else:
+                with open(args.dump_model, "w", encoding="utf-8") as f:
+                    json.dump(model, f, indent=1)
+            if not args.output and not args.shards:
+                sys.exit(0)
+        if args.manifest or args.since or args.changed_files:
+            sources = find_sources(args.sources or DEFAULT_SOURCES)
+            manifest = dependency_manifest(test_parser, tests, scan_sources(sources))
+            if args.manifest:
+                with open(args.manifest, "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, indent=1)
+            if args.since or args.changed_files:
+                changed_files = list(args.changed_files or [])
+                if args.since:
+                    changed_files.extend(git_changed_files(args.since))
+                count = len(tests)
+                tests = select_affected_tests(tests, manifest, changed_files)
+                info("Selected %d of %d tests affected by %d changed files." % (len(tests), count, len(changed_files)))
+        if args.shards:
+            durations = load_durations(args.durations) if args.durations else None
+            os.makedirs(args.shard_dir, exist_ok=True)
+            runners = []
+            for i, shard in enumerate(shard_tests(tests, args.shards, durations), 1):
+                output = os.path.join(args.shard_dir, "shard-%d.vala" % i)
+                runners.append((shard, output, output + ".cache"))
+        else:
+            runners = [(tests, args.output, args.cache or "%s.cache" % args.output)]
+        for tests, output, cache in runners:
+            if output and args.use_cache:
+                generator.update_runner(tests, output, cache)
+            else:
+                with timing("generate"):
+                    result = generator.generate_runner(tests)
+                if output:
+                    with open(output, "w", encoding="utf-8") as f:
+                        f.write(result)
+                else:
+                    sys.stdout.write(result)
+    except (OSError, ValueError, ParseError) as e:
+        sys.stderr.write("%s: %s\n" % ("Parse Error" if isinstance(e, ParseError) else "Error", e))
         sys.exit(1)
+    if args.timings:
+        for name, elapsed in timings.items():
+            sys.stderr.write("Timing: %s %.1f ms\n" % (name, elapsed * 1000))
+    sys.exit(0)
@@ -0,0 +1,727 @@
+#!/usr/bin/env python3
+
+import json
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(TOP_DIR, "tests", "data")
+TESTGEN = os.path.join(TOP_DIR, "testgen.py")
+sys.path.insert(0, TOP_DIR)
+
+import testgen  # noqa: E402
+
+FIXTURES = [
+    os.path.join(DATA_DIR, name) for name in (
+        "dioritetests.vapi", "inheritance.vapi", "syntax.vapi", "interfaces.vapi", "class_fixtures.vapi",
+        "benchmarks.vapi")]
+# The VAPI of Diorite's own tests is checked too if it has been built.
+BUILD_VAPI = os.path.join(TOP_DIR, "build", "dioritetests.vapi")
+if os.path.isfile(BUILD_VAPI):
+    FIXTURES.append(BUILD_VAPI)
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def parse(data, engine):
+    parser = testgen.TestParser(engine)
+    parser.parse(data)
+    return parser
+
+
+class StartupTest(unittest.TestCase):
+    def test_import_defers_heavy_modules(self):
+        # The installed script is compiled and imported on every run, including --help and runs of waf.
+        deferred = (
+            "pyparsing", "subprocess", "threading", "concurrent.futures", "socket", "xml.etree.ElementTree", "math",
+            "glob", "hashlib", "tracemalloc", "ctypes", "queue")
+        code = "import sys; sys.path.insert(0, %r); import testgen; print(' '.join(m for m in %r if m in sys.modules))"
+        output = subprocess.check_output([sys.executable, "-c", code % (TOP_DIR, deferred)], universal_newlines=True)
+        self.assertEqual(output.split(), [])
+
+
+class ParserEnginesTest(unittest.TestCase):
+    def test_engines_build_identical_models(self):
+        for path in FIXTURES:
+            with self.subTest(os.path.basename(path)):
+                differences, _throughput = testgen.compare_parsers(read(path))
+                self.assertEqual(differences, [])
+
+    def test_engines_generate_identical_runners(self):
+        for path in FIXTURES:
+            data = read(path)
+            with self.subTest(os.path.basename(path)):
+                runners = []
+                for engine in testgen.PARSERS:
+                    parser = parse(data, engine)
+                    runners.append(testgen.TestGenerator(parser).generate_runner(list(parser.find_tests())))
+                self.assertEqual(runners[1:], runners[:1] * (len(runners) - 1))
+
+    def test_inherited_tests(self):
+        parser = parse(read(os.path.join(DATA_DIR, "inheritance.vapi")), "fast")
+        paths = [test[0] for test in parser.find_tests()]
+        self.assertEqual(paths, [
+            "/Drt/DerivedTest/test_own", "/Drt/DerivedTest/test_inherited", "/Drt/DerivedTest/test_async_inherited",
+            "/TopTest/test_top", "/TopTest/test_own", "/TopTest/test_inherited", "/TopTest/test_async_inherited"])
+
+    def test_scan_engine_accepts_library_vapi(self):
+        data = read(os.path.join(DATA_DIR, "library.vapi"))
+        for engine in ("pyparsing", "fast"):
+            with self.subTest(engine):
+                self.assertRaises(testgen.ParseError, parse, data, engine)
+        parser = parse(data, "scan")
+        self.assertEqual([test[0] for test in parser.find_tests()], [
+            "/Drt/ComplexTest/test_plain", "/Drt/ComplexTest/test_async", "/Drt/ComplexTest/test_abstract",
+            "/Drt/ComplexTest/test_inherited_generic", "/Drt/ComplexTest/test_virtual"])
+
+    def test_scan_engine_resolves_generic_parents(self):
+        parser = parse(read(os.path.join(DATA_DIR, "generics.vapi")), "scan")
+        self.assertEqual(parser.classes["Drt.GenTest"].parent, "Drt.BaseCase")
+        self.assertEqual(parser.classes["Drt.GenTest"].interfaces, ["Source"])
+        self.assertEqual(parser.ancestors("Drt.NestedGenTest"), ["Drt.BaseCase", "Drt.TestCase"])
+        self.assertEqual([test[0] for test in parser.find_tests()], [
+            "/Drt/GenTest/test_own", "/Drt/GenTest/test_inherited", "/Drt/NestedGenTest/test_inherited"])
+
+    def test_parse_files_resolves_parents_across_files(self):
+        paths = [os.path.join(DATA_DIR, name) for name in ("dioritetests.vapi", "inheritance.vapi")]
+        expected = list(parse(read(paths[0]) + read(paths[1]), "pyparsing").find_tests())
+        for engine in testgen.PARSERS:
+            with self.subTest(engine):
+                parser = testgen.TestParser(engine)
+                parser.parse_files(paths, jobs=1)
+                self.assertEqual(list(parser.find_tests()), expected)
+
+    def test_parse_files_inherits_tests_from_another_file(self):
+        tmp_dir = tempfile.mkdtemp(prefix="testgen-")
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        paths = [os.path.join(tmp_dir, name) for name in ("a.vapi", "b.vapi")]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            f.write(
+                "namespace Drt {\n\tpublic abstract class BaseTest : Drt.TestCase {\n"
+                "\t\tpublic BaseTest ();\n\t\tpublic void test_inherited ();\n\t}\n}\n")
+        with open(paths[1], "w", encoding="utf-8") as f:
+            f.write(
+                "namespace Drt {\n\tpublic class ChildTest : Drt.BaseTest {\n"
+                "\t\tpublic ChildTest ();\n\t\tpublic void test_own ();\n\t}\n}\n")
+        for engine in testgen.PARSERS:
+            for jobs in (1, 2):
+                with self.subTest(engine=engine, jobs=jobs):
+                    parser = testgen.TestParser(engine)
+                    parser.parse_files(paths, jobs=jobs)
+                    self.assertEqual(
+                        [test[0] for test in parser.find_tests()],
+                        ["/Drt/ChildTest/test_own", "/Drt/ChildTest/test_inherited"])
+
+
+def make_tests(counts):
+    return [("/%s/test_%d" % (name, i), name, "test_%d" % i) for name, count in counts for i in range(count)]
+
+
+class ShardTest(unittest.TestCase):
+    def test_classes_are_balanced_by_test_count(self):
+        tests = make_tests([("A", 4), ("B", 3), ("C", 2), ("D", 1)])
+        shards = testgen.shard_tests(tests, 2)
+        self.assertEqual([len(shard) for shard in shards], [5, 5])
+        self.assertEqual(sorted(test for shard in shards for test in shard), sorted(tests))
+        for shard in shards:
+            self.assertEqual(shard, [test for test in tests if test in shard])
+            for name in "ABCD":
+                self.assertIn(len([test for test in shard if test[1] == name]), (0, dict(A=4, B=3, C=2, D=1)[name]))
+
+    def test_classes_are_balanced_by_durations(self):
+        tests = make_tests([("A", 1), ("B", 1), ("C", 2)])
+        durations = {"/A/test_0": 10.0, "/B/test_0": 1.0, "/C/test_0": 1.0, "/C/test_1": 1.0}
+        shards = testgen.shard_tests(tests, 2, durations)
+        self.assertEqual(shards, [tests[:1], tests[1:]])
+        # A test without a known duration counts as an average one.
+        del durations["/C/test_1"]
+        self.assertEqual(testgen.shard_tests(tests, 2, durations), [tests[:1], tests[1:]])
+
+    def test_assignment_is_deterministic(self):
+        tests = make_tests([("A", 2), ("B", 2), ("C", 2), ("D", 2), ("E", 1)])
+        shards = testgen.shard_tests(tests, 3)
+        self.assertEqual(testgen.shard_tests(list(tests), 3), shards)
+        # Classes are assigned by their weight and name, not by the order in which they have been found.
+        reordered = tests[4:] + tests[:4]
+        self.assertEqual(
+            [sorted(shard) for shard in testgen.shard_tests(reordered, 3)], [sorted(shard) for shard in shards])
+
+    def test_more_shards_than_classes(self):
+        shards = testgen.shard_tests(make_tests([("A", 2)]), 3)
+        self.assertEqual([len(shard) for shard in shards], [2, 0, 0])
+
+    def test_load_durations(self):
+        tmp_dir = tempfile.mkdtemp(prefix="testgen-")
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "durations.json")
+        for data, expected in (
+                ({"/A/test_0": 1.5}, {"/A/test_0": 1.5}),
+                ({"tests": [{"path": "/A/test_0", "duration_us": 2500000}]}, {"/A/test_0": 2.5}),
+                ([1, 2], None), ({"/A/test_0": "slow"}, None), ({"tests": [{"path": "/A/test_0"}]}, None)):
+            with self.subTest(data=data):
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                if expected is None:
+                    self.assertRaises(ValueError, testgen.load_durations, path)
+                else:
+                    self.assertEqual(testgen.load_durations(path), expected)
+
+
+class IndexTest(unittest.TestCase):
+    def test_index_of_inherited_tests(self):
+        parser = parse(read(os.path.join(DATA_DIR, "inheritance.vapi")), "fast")
+        entry = parser.index["TopTest"]
+        self.assertEqual(entry.ancestors, ("Drt.DerivedTest", "Drt.BaseCase", "Drt.TestCase"))
+        self.assertEqual(
+            [method.name for method in entry.tests], ["test_top", "test_own", "test_inherited", "test_async_inherited"])
+        # An overridden test method is the one of the subclass.
+        self.assertIs(entry.tests[1], next(m for m in parser.classes["TopTest"].methods if m.name == "test_own"))
+        self.assertEqual(entry.benchmarks, ())
+        self.assertEqual(parser.index["Drt.OrphanTest"].ancestors, ("Missing.Base",))
+        with self.assertRaises(TypeError):
+            parser.index["TopTest"] = entry
+
+    def test_index_of_interfaces(self):
+        parser = parse(read(os.path.join(DATA_DIR, "interfaces.vapi")), "fast")
+        self.assertEqual(parser.index["Drt.IfaceTest"].interfaces, ("Drt.Foo", "Bar"))
+        self.assertEqual(parser.index["Drt.SubIfaceTest"].interfaces, ("Baz", "Drt.Foo", "Bar"))
+        self.assertEqual([method.name for method in parser.index["Drt.SubIfaceTest"].tests], ["test_a"])
+
+    def test_ancestors_and_is_subclass(self):
+        parser = parse(read(os.path.join(DATA_DIR, "inheritance.vapi")), "fast")
+        self.assertEqual(parser.ancestors("Drt.DerivedTest"), ["Drt.BaseCase", "Drt.TestCase"])
+        self.assertEqual(parser.ancestors("Drt.Unknown"), [])
+        top = parser.classes["TopTest"]
+        self.assertTrue(parser.is_subclass(top, "Drt.TestCase"))
+        self.assertTrue(parser.is_subclass(top, "Drt.BaseCase"))
+        self.assertFalse(parser.is_subclass(top, "Drt.OrphanTest"))
+        self.assertFalse(parser.is_subclass(parser.classes["Drt.OrphanTest"], "Drt.TestCase"))
+        # A class which is not in the index is checked by walking its parents.
+        other = testgen.Class("OtherTest", "public", "TopTest")
+        self.assertTrue(parser.is_subclass(other, "Drt.BaseCase"))
+        self.assertFalse(parser.is_subclass(other, "Drt.OrphanTest"))
+
+    def test_cyclic_inheritance_terminates(self):
+        parser = parse(
+            "namespace N {\n\tpublic class ATest : BTest {\n\t\tpublic void test_a ();\n\t}\n"
+            "\tpublic class BTest : ATest {\n\t\tpublic void test_b ();\n\t}\n}\n", "fast")
+        self.assertEqual(set(parser.index), {"N.ATest", "N.BTest"})
+        self.assertFalse(parser.is_subclass(parser.classes["N.ATest"], "Drt.TestCase"))
+        self.assertEqual(list(parser.find_tests()), [])
+
+
+
+class ModelTest(unittest.TestCase):
+    def test_dump_and_load_round_trip(self):
+        for path in FIXTURES:
+            with self.subTest(os.path.basename(path)):
+                parser = parse(read(path), "fast")
+                model = testgen.dump_model(parser)
+                loaded = testgen.load_model(json.loads(json.dumps(model)))
+                self.assertEqual(testgen.dump_model(loaded), model)
+                tests = list(parser.find_tests())
+                self.assertEqual(list(loaded.find_tests()), tests)
+                self.assertEqual(
+                    testgen.TestGenerator(loaded).generate_runner(tests),
+                    testgen.TestGenerator(parser).generate_runner(tests))
+
+    def test_load_rejects_unknown_version(self):
+        model = testgen.dump_model(parse(read(FIXTURES[0]), "fast"))
+        model["version"] += 1
+        self.assertRaises(testgen.ParseError, testgen.load_model, model)
+
+
+class ManifestTest(unittest.TestCase):
+    def test_default_sources_are_relative_to_current_directory(self):
+        cwd = os.getcwd()
+        try:
+            os.chdir(TOP_DIR)
+            sources = testgen.find_sources(testgen.DEFAULT_SOURCES)
+            self.assertIn(os.path.join("src", "glib", "TestCase.vala"), sources)
+            os.chdir(DATA_DIR)
+            self.assertRaises(ValueError, testgen.find_sources, testgen.DEFAULT_SOURCES)
+        finally:
+            os.chdir(cwd)
+
+    def test_missing_source_is_an_error(self):
+        self.assertRaises(ValueError, testgen.find_sources, [os.path.join(DATA_DIR, "Missing.vala")])
+
+    def write_sources(self, sources):
+        tmp_dir = tempfile.mkdtemp(prefix="testgen-")
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        paths = {}
+        for name, data in sources.items():
+            paths[name] = os.path.join(tmp_dir, name)
+            with open(paths[name], "w", encoding="utf-8") as f:
+                f.write(data)
+        return paths
+
+    def test_scan_sources(self):
+        paths = self.write_sources({
+            "Base.vala": (
+                "// class Commented\nnamespace Drt {\n/* class Commented2 { */\n"
+                "public abstract class BaseCase : Drt.TestCase {\n"
+                "\tprivate class Helper {}\n\tstring s = \"class Quoted {\";\n}\n} // namespace Drt\n"),
+            "Derived.vala": (
+                "namespace Drt.Extra {\npublic class DerivedTest : BaseCase {\n\tpublic void test_own() {}\n}\n}\n"
+                "public class TopTest : Drt.Extra.DerivedTest {\n}\n")})
+        self.assertEqual(testgen.scan_sources(sorted(paths.values())), {
+            "Drt.BaseCase": paths["Base.vala"],
+            "Drt.Extra.DerivedTest": paths["Derived.vala"],
+            "TopTest": paths["Derived.vala"]})
+
+    def test_affected_tests(self):
+        parser = parse(read(os.path.join(DATA_DIR, "inheritance.vapi")), "fast")
+        tests = list(parser.find_tests())
+        sources = {"Drt.BaseCase": "/src/BaseCase.vala", "Drt.DerivedTest": "/src/DerivedTest.vala"}
+        manifest = testgen.dependency_manifest(parser, tests, sources)
+        self.assertEqual(manifest["/Drt/DerivedTest/test_own"], {
+            "class": "Drt.DerivedTest", "ancestors": ["Drt.BaseCase", "Drt.TestCase"],
+            "sources": ["/src/BaseCase.vala", "/src/DerivedTest.vala"]})
+        self.assertEqual(manifest["/TopTest/test_top"]["sources"], ["/src/BaseCase.vala", "/src/DerivedTest.vala"])
+
+        def affected(*changed_files):
+            return [test[0] for test in testgen.select_affected_tests(tests, manifest, changed_files)]
+
+        self.assertEqual(affected("/src/Other.vala"), [])
+        self.assertEqual(affected("/src/DerivedTest.vala"), [test[0] for test in tests])
+        del sources["Drt.DerivedTest"]
+        sources["TopTest"] = "/src/TopTest.vala"
+        manifest = testgen.dependency_manifest(parser, tests, sources)
+        self.assertEqual(affected("/src/TopTest.vala"), [test[0] for test in tests if test[1] == "TopTest"])
+        # Tests of a class with unknown sources are always selected.
+        del sources["Drt.BaseCase"], sources["TopTest"]
+        manifest = testgen.dependency_manifest(parser, tests, sources)
+        self.assertEqual(affected("/src/Other.vala"), [test[0] for test in tests])
+        # All tests are selected when testgen itself changes.
+        manifest = testgen.dependency_manifest(parser, tests, {"TopTest": "/src/TopTest.vala"})
+        self.assertEqual(affected(testgen.__file__), [test[0] for test in tests])
+
+    @unittest.skipUnless(shutil.which("git"), "git is not installed")
+    def test_git_changed_files(self):
+        paths = self.write_sources({"A.vala": "a\n", "B.vala": "b\n", ".gitignore": "*.o\n"})
+        top_dir = os.path.dirname(paths["A.vala"])
+        os.mkdir(os.path.join(top_dir, "sub"))
+
+        def git(*args):
+            subprocess.check_call(
+                ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com"] + list(args), cwd=top_dir,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        git("init", "-q")
+        git("add", ".")
+        git("commit", "-q", "-m", "Initial commit")
+        with open(paths["A.vala"], "a", encoding="utf-8") as f:
+            f.write("changed\n")
+        for name in ("C.vala", "ignored.o"):
+            with open(os.path.join(top_dir, name), "w", encoding="utf-8") as f:
+                f.write("new\n")
+        cwd = os.getcwd()
+        try:
+            # Paths are absolute even when run from a subdirectory.
+            os.chdir(os.path.join(top_dir, "sub"))
+            changed = testgen.git_changed_files("HEAD")
+            self.assertRaises(ValueError, testgen.git_changed_files, "no-such-revision")
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(
+            sorted(os.path.realpath(path) for path in changed),
+            [os.path.realpath(os.path.join(top_dir, name)) for name in ("A.vala", "C.vala")])
+
+
+class TestGeneratorTest(unittest.TestCase):
+    def test_hung_concurrent_test_is_torn_down_and_recorded(self):
+        parser = parse(read(os.path.join(DATA_DIR, "dioritetests.vapi")), "fast")
+        generator = testgen.TestGenerator(parser, concurrent_async=4, instrument=True, deadline=1)
+        runner = generator.generate_runner(list(parser.find_tests()))
+        start = runner.index("void diorite_testgen_start_Drt_SystemTest_test_make_dirs()")
+        timeout = runner[runner.index("deadline_timeout(", start):runner.index(".begin(", start)]
+        self.assertIn("test.tear_down();", timeout)
+        self.assertIn('diorite_testgen_record("/Drt/SystemTest/test_make_dirs"', timeout)
+        self.assertIn('\\"hung\\": true', timeout)
+        self.assertIn('diorite_testgen_async_done(test, 1);', timeout)
+
+    def test_table_runner(self):
+        parser = parse(read(os.path.join(DATA_DIR, "inheritance.vapi")), "fast")
+        tests = list(parser.find_tests())
+        runner = testgen.TestGenerator(parser, table=True).generate_runner(tests)
+        self.assertNotIn("diorite_testgen_run_", runner)
+        self.assertEqual(
+            [line.split()[1] for line in runner.splitlines() if line.startswith("Drt.TestCase diorite_testgen_new_")],
+            ["diorite_testgen_new_Drt_DerivedTest()", "diorite_testgen_new_TopTest()"])
+        self.assertIn("Drt.TestCase diorite_testgen_new_TopTest()\n{\n\treturn new TopTest();\n}\n", runner)
+        cases = [line.strip() for line in runner.splitlines() if line.startswith("\tdiorite_testgen_add(")]
+        self.assertEqual([case.split('"')[1] for case in cases], [test[0] for test in tests])
+        self.assertEqual(cases[0], (
+            'diorite_testgen_add("/Drt/DerivedTest/test_own", diorite_testgen_new_Drt_DerivedTest, -1, '
+            '(t, r) => ((Drt.DerivedTest) t).test_own());'))
+        self.assertEqual(cases[-1], (
+            'diorite_testgen_add("/TopTest/test_async_inherited", diorite_testgen_new_TopTest, -1, '
+            '(t, r) => ((TopTest) t).test_async_inherited.end(r), '
+            '(t, c) => ((TopTest) t).test_async_inherited.begin(c));'))
+
+    def test_table_runner_with_class_fixtures(self):
+        parser = parse(read(os.path.join(DATA_DIR, "class_fixtures.vapi")), "fast")
+        runner = testgen.TestGenerator(parser, table=True).generate_runner(list(parser.find_tests()))
+        cases = [line.strip() for line in runner.splitlines() if line.startswith("\tdiorite_testgen_add(")]
+        self.assertEqual([case.split(", ")[2] for case in cases], ["0", "0", "1", "-1"])
+        self.assertIn("\tdiorite_testgen_enter_class(fixture);\n", runner)
+
+    def test_concurrent_tests_are_reported_separately(self):
+        parser = parse(read(os.path.join(DATA_DIR, "dioritetests.vapi")), "fast")
+        runner = testgen.TestGenerator(parser, concurrent_async=4).generate_runner(list(parser.find_tests()))
+        main = runner[runner.index("int main("):]
+        batch = main[main.index("diorite_testgen_run_concurrent_async();"):main.index("return Test.run();")]
+        self.assertEqual(batch.count("GLib.Test.add_func("), 3)
+        self.assertIn(
+            'GLib.Test.add_func("/Drt/SystemTest/test_make_dirs", () => diorite_testgen_async_report(1));', batch)
+        self.assertLess(main.index("GLib.Test.init("), main.index("diorite_testgen_run_concurrent_async();"))
+        self.assertNotIn("concurrent_async\"", main)
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = parse(read(os.path.join(DATA_DIR, "dioritetests.vapi")), "fast")
+        self.tests = list(self.parser.find_tests())
+
+    def generate(self, **options):
+        return testgen.TestGenerator(self.parser, **options).generate_runner(self.tests)
+
+    def function(self, runner, name):
+        start = runner.index(" %s()\n" % name)
+        return runner[start:runner.index("\n}\n", start)]
+
+    def test_no_deadlines_by_default(self):
+        self.assertNotIn("deadline", self.generate())
+        self.assertNotIn("watchdog", self.generate())
+
+    def test_deadlines_override_the_default(self):
+        runner = self.generate(deadline=2, deadlines={"/Drt/SystemTest/test_make_dirs": 0.5, "/Drt/ArraysTest/x": 0})
+        self.assertIn(
+            '\tswitch (path)\n\t{\n'
+            '\tcase "/Drt/ArraysTest/x":\n\t\treturn 0;\n'
+            '\tcase "/Drt/SystemTest/test_make_dirs":\n\t\treturn 500000;\n'
+            '\tdefault:\n\t\treturn 2000000;\n\t}\n', runner)
+        runner = self.generate(deadlines={"/Drt/SystemTest/test_make_dirs": 0.5})
+        self.assertIn("\tdefault:\n\t\treturn 0;\n", runner)
+        self.assertIn("\tif (elapsed * 100 >= deadline * %d)\n" % testgen.NEAR_DEADLINE, runner)
+
+    def test_sync_test_arms_watchdog(self):
+        body = self.function(self.generate(deadline=1), "diorite_testgen_run_Drt_BlobsTest_test_blob_equal")
+        path = '"/Drt/BlobsTest/test_blob_equal"'
+        self.assertIn("diorite_testgen_deadline_begin(%s, deadline, false);" % path, body)
+        self.assertLess(body.index("deadline_begin("), body.index("test.set_up();"))
+        self.assertLess(body.index("test.tear_down();"), body.index("deadline_end(%s" % path))
+        self.assertNotIn("MainLoop", body)
+
+    def test_hung_async_test_stops_its_main_loop(self):
+        body = self.function(self.generate(deadline=1), "diorite_testgen_run_Drt_SystemTest_test_make_dirs")
+        path = '"/Drt/SystemTest/test_make_dirs"'
+        self.assertIn("diorite_testgen_deadline_begin(%s, deadline, true);" % path, body)
+        timeout = body[body.index("deadline_timeout("):body.index(".begin(")]
+        self.assertIn("hung = true;", timeout)
+        self.assertIn("loop.quit();", timeout)
+        self.assertIn("if (hung)\n\t{\n\t\tdiorite_testgen_deadline_hung(test, %s, deadline);" % path, body)
+        self.assertIn("else\n\t{\n\t\tdiorite_testgen_deadline_cancel(deadline_source);", body)
+        # A hung test is still torn down.
+        self.assertLess(body.index("if (hung)"), body.index("test.tear_down();"))
+
+    def test_instrumented_runner_reports_deadlines(self):
+        runner = self.generate(deadline=1, instrument=True)
+        self.assertIn('\\"hung\\": true', self.function(runner, "diorite_testgen_watchdog"))
+        body = self.function(runner, "diorite_testgen_run_Drt_BlobsTest_test_blob_equal")
+        self.assertIn(
+            'string deadline_report = diorite_testgen_deadline_end("/Drt/BlobsTest/test_blob_equal", '
+            'deadline, deadline_start);', body.replace("\n\t\t", " "))
+
+    def test_near_deadlines(self):
+        report = {"tests": [
+            {"path": "/A/fast", "duration_us": 100, "deadline_us": 1000},
+            {"path": "/A/near", "duration_us": 800, "deadline_us": 1000},
+            {"path": "/A/past", "duration_us": 2000, "deadline_us": 1000},
+            {"path": "/A/none", "duration_us": 2000},
+            {"path": "/A/zero", "duration_us": 2000, "deadline_us": 0}]}
+        self.assertEqual(testgen.near_deadlines(report), [("/A/near", 800, 1000), ("/A/past", 2000, 1000)])
+        self.assertEqual(testgen.near_deadlines(report, near=10), [
+            ("/A/fast", 100, 1000), ("/A/near", 800, 1000), ("/A/past", 2000, 1000)])
+        self.assertEqual(testgen.near_deadlines({}), [])
+
+
+class ClassFixturesTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = parse(read(os.path.join(DATA_DIR, "class_fixtures.vapi")), "fast")
+
+    def test_fixtures_are_inherited_or_overridden(self):
+        self.assertEqual(
+            self.parser.find_class_fixtures("Drt.ConnTest"), ("Drt.DbCase.set_up_class", "Drt.DbCase.tear_down_class"))
+        self.assertEqual(
+            self.parser.find_class_fixtures("Drt.OrmTest"), ("Drt.OrmTest.set_up_class", "Drt.DbCase.tear_down_class"))
+        # A private fixture is ignored.
+        self.assertEqual(self.parser.find_class_fixtures("Drt.PlainTest"), (None, None))
+
+    def test_runner_enters_classes(self):
+        tests = list(self.parser.find_tests())
+        generator = testgen.TestGenerator(self.parser)
+        self.assertEqual(list(generator.find_class_fixtures(tests)), ["Drt.ConnTest", "Drt.OrmTest"])
+        runner = generator.generate_runner(tests)
+        enter_class = runner[runner.index("void diorite_testgen_enter_class("):runner.index("\n}\n")]
+        tear_down, set_up = enter_class.split("diorite_testgen_class = index;")
+        self.assertEqual(tear_down.count("Drt.DbCase.tear_down_class();"), 2)
+        self.assertIn("case 0:\n\t\tDrt.DbCase.set_up_class();", set_up)
+        self.assertIn("case 1:\n\t\tDrt.OrmTest.set_up_class();", set_up)
+        classes = (("ConnTest_test_a", 0), ("ConnTest_test_b", 0), ("OrmTest_test_c", 1), ("PlainTest_test_d", -1))
+        for path, index in classes:
+            with self.subTest(path):
+                start = runner.index("void diorite_testgen_run_Drt_%s()" % path)
+                self.assertIn("diorite_testgen_enter_class(%d);" % index, runner[start:runner.index("\n}\n", start)])
+        # The fixture of the last class is torn down after all tests.
+        self.assertIn("int result = Test.run();\n\tdiorite_testgen_enter_class(-1);", runner)
+
+
+class UpdateRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="testgen-")
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.output = os.path.join(self.tmp_dir, "runner.vala")
+        self.cache = self.output + ".cache"
+        self.data = read(os.path.join(DATA_DIR, "dioritetests.vapi"))
+
+    def update(self, data, **options):
+        parser = parse(data, "fast")
+        generator = testgen.TestGenerator(parser, **options)
+        return generator.update_runner(list(parser.find_tests()), self.output, self.cache)
+
+    def test_unchanged_input_is_a_cache_hit(self):
+        self.assertTrue(self.update(self.data))
+        os.utime(self.output, (0, 0))
+        self.assertFalse(self.update(self.data))
+        self.assertEqual(os.stat(self.output).st_mtime, 0)
+
+    def test_changed_input_regenerates_runner(self):
+        self.assertTrue(self.update(self.data))
+        data = self.data.replace(
+            "public void test_pass ();", "public void test_pass ();\n\t\tpublic void test_new ();")
+        self.assertTrue(self.update(data))
+        self.assertIn('"/Drt/JsonParserTest/test_new"', read(self.output))
+        self.assertFalse(self.update(data))
+
+    def test_changed_option_regenerates_runner(self):
+        self.assertTrue(self.update(self.data))
+        self.assertTrue(self.update(self.data, worker=True))
+        self.assertIn("int diorite_testgen_passed = 0;", read(self.output))
+        self.assertFalse(self.update(self.data, worker=True))
+
+    def test_modified_runner_is_regenerated(self):
+        self.assertTrue(self.update(self.data))
+        with open(self.output, "a", encoding="utf-8") as f:
+            f.write("// edited\n")
+        self.assertTrue(self.update(self.data))
+        self.assertNotIn("// edited", read(self.output))
+
+
+class MemcheckTest(unittest.TestCase):
+    def test_parse_memcheck_xml(self):
+        report = testgen.parse_memcheck_xml(os.path.join(DATA_DIR, "memcheck.xml"))
+        self.assertEqual(report["errors"], 1)
+        self.assertEqual(
+            dict(report["kinds"]), {"InvalidRead": 1, "Leak_DefinitelyLost": 2, "Leak_PossiblyLost": 1})
+        self.assertEqual(report["definitely_lost"], 40)
+        self.assertEqual(report["indirectly_lost"], 0)
+        self.assertEqual(report["possibly_lost"], 352)
+        self.assertEqual(report["still_reachable"], 0)
+
+    def test_invalid_xml_is_an_error(self):
+        tmp_dir = tempfile.mkdtemp(prefix="testgen-")
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "memcheck.xml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("<valgrindoutput><error>")
+        self.assertRaises(ValueError, testgen.parse_memcheck_xml, path)
+
+
+def benchmark(path, samples):
+    return {"path": path, "median_ns": sorted(samples)[len(samples) // 2], "samples_ns": samples}
+
+
+class CompareBenchmarksTest(unittest.TestCase):
+    # Expected values are those of R's wilcox.test(new, old, alternative = "greater", exact = FALSE).
+    def test_mann_whitney(self):
+        u, p = testgen.mann_whitney([1, 2, 3], [4, 5, 6])
+        self.assertEqual(u, 9)
+        self.assertAlmostEqual(p, 0.04043, places=5)
+        u, p = testgen.mann_whitney([4, 5, 6], [1, 2, 3])
+        self.assertEqual(u, 0)
+        self.assertAlmostEqual(p, 0.98545, places=5)
+
+    def test_mann_whitney_with_ties(self):
+        u, p = testgen.mann_whitney([1, 2, 2, 3], [2, 3, 3, 4])
+        self.assertEqual(u, 13)
+        self.assertAlmostEqual(p, 0.08602, places=5)
+        self.assertEqual(testgen.mann_whitney([1, 1], [1, 1]), (2, 1.0))
+
+    def test_compare_benchmarks(self):
+        old = {"benchmarks": [
+            benchmark("/slower", [98, 99, 100, 101, 102]),
+            benchmark("/faster", [118, 119, 120, 121, 122]),
+            benchmark("/small", [98, 99, 100, 101, 102]),
+            benchmark("/noisy", [50, 100, 150]),
+            benchmark("/removed", [1, 2, 3])]}
+        new = {"benchmarks": [
+            benchmark("/slower", [118, 119, 120, 121, 122]),
+            benchmark("/faster", [98, 99, 100, 101, 102]),
+            benchmark("/small", [101, 102, 103, 104, 105]),
+            benchmark("/noisy", [60, 110, 160]),
+            benchmark("/new", [5, 5, 5])]}
+        results = testgen.compare_benchmarks(old, new, threshold=5.0)
+        self.assertEqual([(path, status) for path, *_values, status in results], [
+            ("/slower", "SLOWER"), ("/faster", "FASTER"), ("/small", "SAME"), ("/noisy", "SAME"), ("/new", "NEW")])
+        path, old_median, new_median, change, p, status = results[0]
+        self.assertEqual((old_median, new_median, change), (100, 120, 20.0))
+        self.assertAlmostEqual(p, 0.00609, places=5)
+        self.assertAlmostEqual(results[1][3], -100 / 6)
+        self.assertAlmostEqual(results[3][4], 0.33126, places=5)
+        self.assertEqual(results[4], ("/new", None, 5, None, None, "NEW"))
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+    def test_synthetic_vapi(self):
+        data = testgen.synthetic_vapi(4, depth=2, methods=4, namespaces=2, async_every=2, throws_every=3)
+        parser = parse(data, "fast")
+        self.assertEqual(len(parser.classes), 4)
+        self.assertEqual(parser.ancestors("Bench1.Chain0Level1Test"), ["Bench1.Chain0Level0Test", "Drt.TestCase"])
+        tests = list(parser.find_tests())
+        # A subclass inherits all tests of its parent.
+        self.assertEqual(len(tests), 2 * (4 + 4 + 4))
+        self.assertEqual(sum(1 for test in tests if test[3]), 2 * 6)
+        self.assertEqual(sum(1 for test in tests if test[4]), 2 * 6)
+
+    def test_benchmark_suite(self):
+        report = testgen.benchmark_suite([20, 40], "scan", namespaces=2, methods=10, depth=2)
+        self.assertEqual(report["engine"], "scan")
+        self.assertEqual(
+            [(result["methods"], result["classes"], result["tests"]) for result in report["results"]],
+            [(20, 2, 20), (40, 4, 60)])
+        for result in report["results"]:
+            self.assertEqual(list(result["phases"]), list(testgen.BENCHMARK_PHASES))
+            for phase in result["phases"].values():
+                self.assertGreaterEqual(phase["seconds"], 0)
+                self.assertGreater(phase["peak_kib"], 0)
+        json.dumps(report)
+
+    def test_default_engine(self):
+        output = subprocess.check_output(
+            [sys.executable, TESTGEN, "--benchmark-suite", "-", "--sizes", "10"], stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+        self.assertEqual(json.loads(output)["engine"], testgen.BENCHMARK_ENGINE)
+
+
+class ChunkCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="testgen-")
+        self.path = os.path.join(self.tmp_dir, "tests.vapi")
+        shutil.copy(os.path.join(DATA_DIR, "dioritetests.vapi"), self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def parse_cached(self, cache):
+        parsed = []
+        parse_chunk = cache.parse_chunk
+
+        def counting_parse_chunk(*args):
+            parsed.append(args)
+            return parse_chunk(*args)
+
+        cache.parse_chunk = counting_parse_chunk
+        try:
+            return cache.parse([self.path]), len(parsed)
+        finally:
+            del cache.parse_chunk
+
+    def test_cached_model_matches_full_parse(self):
+        for engine in testgen.PARSERS:
+            with self.subTest(engine):
+                cache = testgen.ChunkCache(engine)
+                expected = testgen.describe_model(parse(read(self.path), engine))
+                for i in range(2):
+                    parser, _parsed = self.parse_cached(cache)
+                    self.assertEqual(testgen.describe_model(parser), expected)
+
+    def test_only_changed_declarations_are_parsed(self):
+        cache = testgen.ChunkCache("fast")
+        _parser, parsed = self.parse_cached(cache)
+        self.assertGreater(parsed, 1)
+        _parser, parsed = self.parse_cached(cache)
+        self.assertEqual(parsed, 0)
+        data = read(self.path).replace(
+            "public void test_pass ();", "public void test_pass ();\n\t\tpublic void test_new ();")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(data)
+        parser, parsed = self.parse_cached(cache)
+        self.assertEqual(parsed, 1)
+        self.assertIn("/Drt/JsonParserTest/test_new", [test[0] for test in parser.find_tests()])
+
+    def test_declarations_without_classes_are_cached(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("namespace Drt {\n\tpublic delegate void TestCallback ();\n}\n")
+        cache = testgen.ChunkCache("scan")
+        self.parse_cached(cache)
+        _parser, parsed = self.parse_cached(cache)
+        self.assertEqual(parsed, 0)
+
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="testgen-")
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.socket = os.path.join(self.tmp_dir, "testgen.sock")
+        self.server = testgen.Daemon("fast").serve(self.socket)
+        self.addCleanup(self.server.close)
+        self.vapi = os.path.join(DATA_DIR, "dioritetests.vapi")
+
+    def run_testgen(self, *args):
+        """Run testgen.py and return what it and the daemon wrote to standard error."""
+        daemon_log = io.StringIO()
+        with redirect_stderr(daemon_log):
+            process = subprocess.run(
+                [sys.executable, TESTGEN] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return process.stderr, daemon_log.getvalue()
+
+    def test_connect_generates_same_runner_as_local_run(self):
+        local, remote = (os.path.join(self.tmp_dir, name) for name in ("local.vala", "remote.vala"))
+        for flags in (
+                [], ["--parser", "scan", "--instrument", "--concurrent-async", "2"], ["--table", "--no-cache"],
+                ["--deadline", "1", "--cache", os.path.join(self.tmp_dir, "custom.cache")]):
+            with self.subTest(flags=flags):
+                self.run_testgen("-i", self.vapi, "-o", local, "--no-cache", *flags)
+                _output, daemon_log = self.run_testgen("--connect", self.socket, "-i", self.vapi, "-o", remote, *flags)
+                self.assertIn("Generated %s" % remote, daemon_log)
+                self.assertEqual(read(remote), read(local))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir, "custom.cache")))
+
+    def test_unsupported_flags_are_handled_locally(self):
+        output = os.path.join(self.tmp_dir, "runner.vala")
+        model = os.path.join(self.tmp_dir, "model.json")
+        log, daemon_log = self.run_testgen(
+            "--connect", self.socket, "-i", self.vapi, "-o", output, "--dump-model", model, "--parser", "fast")
+        self.assertIn("generated locally", log)
+        self.assertEqual(daemon_log, "")
+        self.assertTrue(os.path.isfile(model))
+        self.assertEqual(read(output), testgen.TestGenerator(parse(read(self.vapi), "fast")).generate_runner(
+            list(parse(read(self.vapi), "fast").find_tests())))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import glob
+import os
+import sys
+import unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+# waflib is unpacked next to the waf script when it runs for the first time.
+sys.path[1:1] = sorted(glob.glob(os.path.join(TOP_DIR, ".waf*-*")))
+
+try:
+    from waflib import Errors
+    import valadoc
+except ImportError:
+    valadoc = None
+
+SOURCE = """
+namespace Drt {
+
+/**
+ * A key-value storage.
+ */
+public class Storage : GLib.Object {
+	public string name {get; set; default = "storage";}
+
+	public Storage(string name) {
+		this.name = name;
+	}
+
+	/**
+	 * Return a value.
+	 */
+	public string? get_value(string key) throws GLib.Error {
+		// Look the key up.
+		if (key == "}") {
+			return null;
+		}
+		return key;
+	}
+}
+
+} // namespace Drt
+"""
+
+
+@unittest.skipIf(valadoc is None, "waflib is not available, run ./waf first")
+class ApiSurfaceTest(unittest.TestCase):
+    def assertSameSurface(self, old, new):
+        self.assertEqual(valadoc.api_surface(SOURCE.replace(old, new)), valadoc.api_surface(SOURCE))
+
+    def assertDifferentSurface(self, old, new):
+        self.assertIn(old, SOURCE)
+        self.assertNotEqual(valadoc.api_surface(SOURCE.replace(old, new)), valadoc.api_surface(SOURCE))
+
+    def test_bodies_and_comments_are_stripped(self):
+        surface = valadoc.api_surface(SOURCE)
+        self.assertIn("public string? get_value(string key) throws GLib.Error\n{}", surface)
+        self.assertIn("/**\n\t * Return a value.\n\t */", surface)
+        self.assertNotIn("Look the key up", surface)
+        self.assertNotIn("return", surface)
+
+    def test_implementation_changes_keep_surface(self):
+        self.assertSameSurface("return key;", "return key.strip();")
+        self.assertSameSurface('if (key == "}") {', 'if (key == "{") {')
+        self.assertSameSurface("this.name = name;", "this.name = name;\n\t\tnotify_property(\"name\");")
+        self.assertSameSurface("// Look the key up.", "// Look the key up in a hash table.")
+        self.assertSameSurface("\tpublic Storage(string name) {", "\tpublic  Storage(string name)\n\t{")
+
+    def test_api_changes_alter_surface(self):
+        self.assertDifferentSurface("get_value(string key)", "get_value(string key, int flags)")
+        self.assertDifferentSurface("public string? get_value", "public string get_value")
+        self.assertDifferentSurface("throws GLib.Error {", "{")
+        self.assertDifferentSurface("Return a value.", "Return a value or null.")
+        self.assertDifferentSurface('default = "storage";', 'default = "store";')
+        self.assertDifferentSurface("public class Storage", "public abstract class Storage")
+
+
+class FakeNode:
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+
+
+class FakeTask:
+    def __init__(self, target):
+        self.outputs = [FakeNode(target + ".vapi", FakeNode(target))]
+
+
+class FakeTaskGen:
+    def __init__(self, bld, target, use):
+        self.bld = bld
+        self.target = target
+        self.use = use
+        self.tasks = [FakeTask(target)]
+
+    def post(self):
+        self.bld.posted.append(self.target)
+
+
+class FakeBuild:
+    """A build context with task generators which use each other according to a graph."""
+    def __init__(self, graph):
+        self.tgens = {name: FakeTaskGen(self, name, use) for name, use in graph.items()}
+        self.posted = []
+
+    def get_tgen_by_name(self, name):
+        try:
+            return self.tgens[name]
+        except KeyError:
+            raise Errors.WafError("Could not find a task generator for the name %r" % name)
+
+
+@unittest.skipIf(valadoc is None, "waflib is not available, run ./waf first")
+class UseClosureTest(unittest.TestCase):
+    def closure(self, bld, name):
+        closure = valadoc.vala_use_closure(bld, name)
+        packages, vapi_dirs, tasks = closure
+        self.assertEqual([node.name for node in vapi_dirs], list(packages))
+        self.assertEqual([task.outputs[0].name for task in tasks], [package + ".vapi" for package in packages])
+        return packages
+
+    def test_diamond(self):
+        bld = FakeBuild({"app": "left right glib-2.0", "left": "base", "right": "base", "base": ""})
+        self.assertEqual(self.closure(bld, "app"), ("app", "left", "base", "right"))
+        self.assertEqual(bld.posted.count("base"), 1)
+        self.assertEqual(self.closure(bld, "right"), ("right", "base"))
+        self.assertEqual(self.closure(bld, "base"), ("base",))
+        self.assertIsNone(valadoc.vala_use_closure(bld, "glib-2.0"))
+        # Every task generator has been visited only once.
+        self.assertEqual(sorted(bld.posted), ["app", "base", "left", "right"])
+
+    def test_cycle(self):
+        graph = {"a": "b", "b": "c", "c": "a d", "d": ""}
+        expected = {"a": ("a", "b", "c", "d"), "b": ("b", "c", "a", "d"), "c": ("c", "a", "b", "d"), "d": ("d",)}
+        for first in sorted(graph):
+            with self.subTest(first=first):
+                bld = FakeBuild(graph)
+                self.assertEqual(self.closure(bld, first), expected[first])
+                # Closures of the other task generators of the cycle are complete too, not cut where it was entered.
+                for name in sorted(graph):
+                    self.assertEqual(self.closure(bld, name), expected[name])
+
+
+if __name__ == "__main__":
+    unittest.main()
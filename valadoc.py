@@ -31,9 +31,68 @@ IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE.
 """
 
+import hashlib
+import re
+
 from waflib import Task, Utils, Errors, Logs, Options, Node, Build
+from waflib.Configure import conf
 from waflib.TaskGen import feature, before_method
 
+API_FINGERPRINT = '.api-fingerprint'
+
+# Comments (doc comments are kept), string and character literals and braces.
+API_TOKEN_RE = re.compile(r'''
+	(?P<doc>/\*\*(?!/).*?\*/)
+	| (?P<comment>//[^\n]*|/\*.*?\*/)
+	| (?P<string>"""(?:.|\n)*?"""|@?"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+	| (?P<brace>[{};])
+	''', re.VERBOSE | re.DOTALL)
+
+# A block which follows a declaration header ending like this is an implementation.
+API_BODY_RE = re.compile(r'(?:\)|\bthrows\s+[\w.,\s]+|\b(?:get|set|construct|default))\s*$')
+
+
+def api_surface(text):
+	"""
+	Strip Vala source code of everything which cannot affect documentation.
+	
+	Method, accessor and construct bodies and ordinary comments are removed, declarations and doc comments
+	are kept with normalized white space.
+	"""
+	result = []
+	header = []
+	depth = 0
+	pos = 0
+	for match in API_TOKEN_RE.finditer(text):
+		if depth == 0:
+			header.append(text[pos:match.start()])
+		pos = match.end()
+		kind = match.lastgroup
+		value = match.group()
+		if depth > 0:
+			if value == '{':
+				depth += 1
+			elif value == '}':
+				depth -= 1
+			continue
+		if kind == 'comment':
+			header.append(' ')
+		elif kind == 'doc':
+			result.append(value)
+		elif kind == 'string':
+			header.append(value)
+		elif value == '{' and API_BODY_RE.search(''.join(header)):
+			result.append(' '.join(''.join(header).split()))
+			result.append('{}')
+			header = []
+			depth = 1
+		else:
+			result.append(' '.join(''.join(header).split()))
+			result.append(value)
+			header = []
+	result.append(' '.join(''.join(header + [text[pos:]]).split()))
+	return '\n'.join(item for item in result if item)
+
 
 class valadoc(Task.Task):
 	vars  = ['VALADOC', 'VALADOCFLAGS']
@@ -43,13 +102,106 @@ class valadoc(Task.Task):
 	def runnable_status(self):
 		if self.skip:
 			return Task.SKIP_ME 
-		else:
-			return super(valadoc, self).runnable_status()
+		status = super(valadoc, self).runnable_status()
+		if status == Task.RUN_ME:
+			# Implementation-only changes of the sources don't change the documentation.
+			stamp = self.output_dir.find_node(API_FINGERPRINT)
+			if stamp and stamp.read().strip() == self.api_fingerprint():
+				return Task.SKIP_ME
+		return status
+	
+	def api_fingerprint(self):
+		"""Return a digest of VALADOCFLAGS, API surface of inputs and VAPI files of used packages."""
+		digest = hashlib.sha256()
+		digest.update(repr(self.env.VALADOC + self.env.VALADOCFLAGS).encode('utf-8'))
+		for node in self.inputs:
+			digest.update(node.abspath().encode('utf-8'))
+			digest.update(api_surface(node.read(encoding='utf-8')).encode('utf-8'))
+		for node in getattr(self, 'dep_vapis', []):
+			digest.update(node.abspath().encode('utf-8'))
+			digest.update(Utils.h_file(node.abspath()))
+		return digest.hexdigest()
 	
 	def run(self):
 		cmd = self.env.VALADOC + self.env.VALADOCFLAGS
 		cmd.extend([a.abspath() for a in self.inputs])
-		return self.exec_command(cmd)
+		result = self.exec_command(cmd)
+		if not result:
+			self.output_dir.make_node(API_FINGERPRINT).write(self.api_fingerprint())
+		return result
+
+
+@conf
+def vala_use_closure(bld, name):
+	"""
+	Resolve Vala packages, VAPI directories and VAPI-generating tasks of a task generator and of everything it
+	uses transitively.
+	
+	The result is a tuple of tuples (packages, vapi_dirs, tasks) or None if there is no task generator with that
+	name (e.g. an uselib name). Results are memoized for the whole build context, so each task generator is
+	visited only once regardless of how many valadoc task generators use it.
+	"""
+	try:
+		cache = bld.vala_use_closure_cache
+	except AttributeError:
+		cache = bld.vala_use_closure_cache = {}
+	return resolve_use_closure(bld, name, cache, [])[0]
+
+
+def resolve_use_closure(bld, name, cache, stack):
+	"""
+	Return the closure of a task generator and the lowest position in the stack of task generators being resolved
+	which it reaches through a cycle of `use`.
+	
+	A closure reaching a task generator further up the stack lacks items of that task generator and is not
+	memoized, the closure of the task generator which starts the cycle is complete.
+	"""
+	try:
+		return cache[name], len(stack)
+	except KeyError:
+		pass
+	if name in stack:
+		return ((), (), ()), stack.index(name)
+	
+	try:
+		tgen = bld.get_tgen_by_name(name)
+	except Errors.WafError:
+		cache[name] = None
+		return None, len(stack)
+	
+	depth = len(stack)
+	stack.append(name)
+	packages, vapi_dirs, tasks = [], [], []
+	seen = set()
+	
+	def merge(closure):
+		for i, (lst, items) in enumerate(zip((packages, vapi_dirs, tasks), closure)):
+			for item in items:
+				if (i, item) not in seen:
+					seen.add((i, item))
+					lst.append(item)
+	
+	# in practice the other task is already processed
+	# but this makes it explicit
+	tgen.post()
+	for task in tgen.tasks:
+		if isinstance(task, Build.inst):
+			# TODO are we not expecting just valatask here?
+			continue
+		for output in task.outputs:
+			if output.name == tgen.target + ".vapi":
+				merge(((tgen.target,), (output.parent,), (task,)))
+	low = depth
+	for used in Utils.to_list(getattr(tgen, 'use', [])):
+		closure, used_low = resolve_use_closure(bld, used, cache, stack)
+		low = min(low, used_low)
+		if closure:
+			merge(closure)
+	stack.pop()
+	result = (tuple(packages), tuple(vapi_dirs), tuple(tasks))
+	if low >= depth:
+		cache[name] = result
+	return result, low
 
 
 @before_method('process_source')
@@ -77,6 +229,7 @@ def process_valadoc2(self):
 		pass
 	
 	valadoctask = self.valadoctask = self.create_task('valadoc')
+	valadoctask.dep_vapis = []
 	
 	def addflags(flags):
 		self.env.append_value('VALADOCFLAGS', flags)
@@ -148,41 +301,22 @@ def process_valadoc2(self):
 	if self.vala_target_glib:
 		addflags('--target-glib=%s' % self.vala_target_glib)
 	
-	if hasattr(self, 'use'):
-		local_packages = Utils.to_list(self.use)[:] # make sure to have a copy
-		seen = []
-		while len(local_packages) > 0:
-			package = local_packages.pop()
-			if package in seen:
-				continue
-			seen.append(package)
-			
-			# check if the package exists
-			try:
-				package_obj = self.bld.get_tgen_by_name(package)
-			except Errors.WafError:
-				continue
-
-			# in practice the other task is already processed
-			# but this makes it explicit
-			package_obj.post()
-			package_name = package_obj.target
-			for task in package_obj.tasks:
-				if isinstance(task, Build.inst):
-					# TODO are we not expecting just valatask here?
-					continue
-				for output in task.outputs:
-					if output.name == package_name + ".vapi":
-						valadoctask.set_run_after(task)
-						if package_name not in self.packages:
-							self.packages.append(package_name)
-						if output.parent not in self.vapi_dirs:
-							self.vapi_dirs.append(output.parent)
-
-			if hasattr(package_obj, 'use'):
-				lst = self.to_list(package_obj.use)
-				lst.reverse()
-				local_packages = [pkg for pkg in lst if pkg not in seen] + local_packages
+	for package in self.use:
+		closure = self.bld.vala_use_closure(package)
+		if not closure:
+			continue
+		packages, vapi_dirs, tasks = closure
+		for package_name in packages:
+			if package_name not in self.packages:
+				self.packages.append(package_name)
+		for vapi_dir in vapi_dirs:
+			if vapi_dir not in self.vapi_dirs:
+				self.vapi_dirs.append(vapi_dir)
+		for task in tasks:
+			valadoctask.set_run_after(task)
+			for output in task.outputs:
+				if output.name[:-5] in packages and output.suffix() == ".vapi" and output not in valadoctask.dep_vapis:
+					valadoctask.dep_vapis.append(output)
 	
 	addflags(['--define=%s' % x for x in self.vala_defines])
 	addflags(['--pkg=%s' % x for x in self.packages])